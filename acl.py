@@ -0,0 +1,218 @@
+import sys
+from enum import Enum
+from typing import Dict, List
+
+import numpy as np
+
+# access rights and ACE constants from winnt.h, so the ACL model does not need pywin32
+GENERIC_READ = 0x80000000
+GENERIC_WRITE = 0x40000000
+GENERIC_EXECUTE = 0x20000000
+FILE_READ_DATA = 0x0001
+FILE_WRITE_DATA = 0x0002
+FILE_EXECUTE = 0x0020
+FILE_READ_ATTRIBUTES = 0x0080
+FILE_GENERIC_READ = 0x120089
+FILE_GENERIC_WRITE = 0x120116
+FILE_GENERIC_EXECUTE = 0x1200A0
+ACCESS_ALLOWED_ACE_TYPE = 0
+ACCESS_DENIED_ACE_TYPE = 1
+OBJECT_INHERIT_ACE = 0x01
+CONTAINER_INHERIT_ACE = 0x02
+INHERITED_ACE = 0x10
+
+
+class AceType(Enum):
+    ALLOWED = ACCESS_ALLOWED_ACE_TYPE
+    DENIED = ACCESS_DENIED_ACE_TYPE
+
+
+class Ace(object):
+    def __init__(self, name: str, right: int, type: AceType = AceType.ALLOWED):
+        self.name = name
+        self.right = right
+        self.type = type
+
+    def __eq__(self, other):
+        if isinstance(other, Ace):
+            return self.name == other.name and self.type == other.type and self.right == other.right
+        raise ValueError
+
+
+# (real right bits, normalized bit) of the rights we use
+ALLOW_BITS = ((GENERIC_READ, 0b001),
+              (GENERIC_WRITE | FILE_READ_ATTRIBUTES, 0b010),
+              (GENERIC_EXECUTE, 0b100))
+DENY_BITS = ((FILE_READ_DATA, 0b001 << 3),
+             (FILE_WRITE_DATA, 0b010 << 3),
+             (FILE_EXECUTE, 0b100 << 3))
+
+
+def _real_right(bits, right: int) -> int:
+    res_right = 0b0
+    for real_bits, normalized_bit in bits:
+        if normalized_bit & right:
+            res_right |= real_bits
+    return res_right
+
+
+def _effective_right(right: int) -> int:
+    if right & 0b111000 == 0:
+        return right
+    return right & (0b111000 | (~right) >> 3)
+
+
+# lookup tables indexed by a normalized mask (0..63)
+ALLOW_RIGHTS = np.array([_real_right(ALLOW_BITS, right) for right in range(64)], dtype=np.uint32)
+DENY_RIGHTS = np.array([_real_right(DENY_BITS, right) for right in range(64)], dtype=np.uint32)
+EFFECTIVE_RIGHTS = np.array([_effective_right(right) for right in range(64)], dtype=np.uint8)
+# masks are equal when their allow bits are equal
+EQUALITY_CLASSES = np.array([right & 0b000111 for right in range(64)], dtype=np.uint8)
+# (ace type, real right) -> normalized mask for every right built by real_right
+NORMALIZED_ACES = dict(
+    [((AceType.ALLOWED, int(ALLOW_RIGHTS[right])), right) for right in range(8)] +
+    [((AceType.DENIED, int(DENY_RIGHTS[right << 3])), right << 3) for right in range(8)])
+
+
+class NormalizedRight(object):
+    @staticmethod
+    def normalized_ace(ace: Ace):
+        return NormalizedRight.normalized_right(ace.type, ace.right)
+
+    @staticmethod
+    def normalized_right(type: AceType, real_right: int) -> int:
+        right = NORMALIZED_ACES.get((type, real_right))
+        if right is None:
+            right = 0b0
+            for real_bits, normalized_bit in (ALLOW_BITS if type == AceType.ALLOWED else DENY_BITS):
+                if real_bits & real_right:
+                    right |= normalized_bit
+        return right
+
+    @staticmethod
+    def normalized_aces(rights: np.ndarray, denied: np.ndarray) -> np.ndarray:
+        """
+        :param rights: real rights of ACEs
+        :param denied: True for ACCESS_DENIED ACEs
+        :return: normalized mask of every ACE
+        """
+        rights = np.asarray(rights, dtype=np.uint32)
+        result = np.zeros(rights.shape, dtype=np.uint8)
+        for (allow_bits, allow_bit), (deny_bits, deny_bit) in zip(ALLOW_BITS, DENY_BITS):
+            result |= np.where(denied, np.where(rights & deny_bits, deny_bit, 0),
+                               np.where(rights & allow_bits, allow_bit, 0)).astype(np.uint8)
+        return result
+
+    @staticmethod
+    def real_right(user_name: str, normalized_right: int) -> List[Ace]:
+        result = []
+        res_right = NormalizedRight.real_allow_right(normalized_right)
+        if res_right != 0:
+            result.append(Ace(user_name, res_right))
+
+        res_right = NormalizedRight.real_deny_right(normalized_right)
+        if res_right != 0:
+            result.append(Ace(user_name, res_right, AceType.DENIED))
+
+        return result
+
+    @staticmethod
+    def real_allow_right(right):
+        return int(ALLOW_RIGHTS[right])
+
+    @staticmethod
+    def real_allow_rights(rights: np.ndarray) -> np.ndarray:
+        return ALLOW_RIGHTS[rights]
+
+    @staticmethod
+    def real_deny_right(right):
+        return int(DENY_RIGHTS[right])
+
+    @staticmethod
+    def real_deny_rights(rights: np.ndarray) -> np.ndarray:
+        return DENY_RIGHTS[rights]
+
+    @staticmethod
+    def is_allow(right: int):
+        return right < 8
+
+    @staticmethod
+    def print(right):
+        print("{:0>6b}".format(right))
+
+    @staticmethod
+    def effective_right(right):
+        return int(EFFECTIVE_RIGHTS[right])
+
+    @staticmethod
+    def effective_rights(rights: np.ndarray) -> np.ndarray:
+        return EFFECTIVE_RIGHTS[rights]
+
+    @staticmethod
+    def is_equal(r1, r2):
+        return EQUALITY_CLASSES[r1] == EQUALITY_CLASSES[r2]
+
+    @staticmethod
+    def are_equal(r1: np.ndarray, r2: np.ndarray) -> np.ndarray:
+        return EQUALITY_CLASSES[r1] == EQUALITY_CLASSES[r2]
+
+
+class File(object):
+    def __init__(self, name: str, rights_list: List[Ace]):
+        self.name = name
+        self.rights_list = rights_list
+
+    def get_user_mask(self, user: str):
+        mask = 0
+        for ace in self.rights_list:
+            if ace.name == user:
+                mask |= NormalizedRight.normalized_ace(ace)
+        return mask
+
+    def get_file_vector(self, objects: List[str]) -> List[int]:
+        res = []
+        for obj in objects:
+            res.append(self.get_user_mask(obj))
+        return res
+
+
+class AclMatrix(object):
+    """
+    ACLs of many files: a dense (files x users) uint8 matrix of normalized masks,
+    a user name -> column index and a table of interned file names.
+    File/Ace objects are built only when a file has to reach the OS.
+    """
+
+    def __init__(self, users: List[str], masks: np.ndarray = None, names: List[str] = None,
+                 user_index: Dict[str, int] = None):
+        self.users = users
+        self.user_index = {user: i for i, user in enumerate(users)} if user_index is None else user_index
+        self.masks = np.zeros((0, len(users)), dtype=np.uint8) if masks is None else masks
+        self.names = [] if names is None else names
+
+    def __len__(self):
+        return len(self.masks)
+
+    def set_name(self, file_index: int, name: str):
+        self.names[file_index] = sys.intern(name)
+
+    def file(self, file_index: int) -> File:
+        rights_list = []
+        row = self.masks[file_index]
+        for user in np.flatnonzero(row):
+            rights_list.extend(NormalizedRight.real_right(self.users[user], int(row[user])))
+        return File(self.names[file_index], rights_list)
+
+    def get_file_vector(self, file_index: int) -> np.ndarray:
+        return self.masks[file_index]
+
+    def take(self, file_indexes: List[int]) -> 'AclMatrix':
+        """
+        :return: copy of the given files
+        """
+        return AclMatrix(self.users, self.masks[file_indexes], [self.names[i] for i in file_indexes], self.user_index)
+
+    @property
+    def number_of_ace(self) -> int:
+        # an allow and a deny ACE at most for every nonzero mask
+        return int(np.count_nonzero(self.masks & 0b000111) + np.count_nonzero(self.masks & 0b111000))
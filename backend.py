@@ -0,0 +1,668 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+import instrumentation
+from acl import (Ace, AceType, File, NormalizedRight, ACCESS_ALLOWED_ACE_TYPE, CONTAINER_INHERIT_ACE,
+                 FILE_EXECUTE, FILE_GENERIC_EXECUTE, FILE_GENERIC_READ, FILE_GENERIC_WRITE, FILE_READ_ATTRIBUTES,
+                 FILE_READ_DATA, FILE_WRITE_DATA, GENERIC_EXECUTE, GENERIC_READ, GENERIC_WRITE, INHERITED_ACE,
+                 OBJECT_INHERIT_ACE)
+
+try:
+    import win32net
+    import win32netcon
+    import win32security
+except ImportError:
+    # pywin32 is only available on Windows, WinApi can not be used without it
+    win32net = win32netcon = win32security = None
+
+ADMIN_NAME = 'Enot'
+USER_SUBNAME = "LabUser"
+
+
+class SidCache(object):
+    """
+    Bidirectional account name <-> SID cache with LRU eviction and an optional time to live.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = None, sid_key: Callable = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: seconds an entry stays valid (None means forever)
+        :param sid_key: makes a hashable key from a SID, None means the SIDs are the keys.
+        A backend sets its own AclBackend.sid_key if none is given.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sid_key = sid_key
+        self.clock = clock
+        self.sids = OrderedDict()  # name -> (sid, expiration time)
+        self.names = OrderedDict()  # sid key -> (name, expiration time)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, sid):
+        return sid if self.sid_key is None else self.sid_key(sid)
+
+    def _get(self, entries: OrderedDict, key):
+        with self.lock:
+            entry = entries.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] > self.clock():
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del entries[key]
+            self.misses += 1
+            return None
+
+    def _put(self, entries: OrderedDict, key, value):
+        entries[key] = (value, None if self.ttl is None else self.clock() + self.ttl)
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def put(self, name: str, sid):
+        with self.lock:
+            self._put(self.sids, name, sid)
+            self._put(self.names, self.key(sid), name)
+
+    def sid(self, name: str, resolve: Callable):
+        """
+        :param resolve: called on a miss to get the SID of the name
+        """
+        sid = self._get(self.sids, name)
+        if sid is None:
+            sid = resolve(name)
+            self.put(name, sid)
+        return sid
+
+    def name(self, sid, resolve: Callable) -> str:
+        """
+        :param resolve: called on a miss to get the name of the SID
+        """
+        name = self._get(self.names, self.key(sid))
+        if name is None:
+            name = resolve(sid)
+            self.put(name, sid)
+        return name
+
+    def forget(self, name: str):
+        with self.lock:
+            entry = self.sids.pop(name, None)
+            if entry is not None:
+                self.names.pop(self.key(entry[0]), None)
+
+
+class AclBackend(object):
+    """
+    Files, folders, their DACLs and the principals named in the DACLs.
+    Subclasses implement the primitives, composite operations are built on them.
+    Account names and SIDs are resolved through self.sid_cache.
+    """
+    # names of service files kept inside the managed tree
+    hidden_names = ()
+
+    def __init__(self, sid_cache: SidCache = None):
+        self.sid_cache = SidCache() if sid_cache is None else sid_cache
+        if self.sid_cache.sid_key is None:
+            self.sid_cache.sid_key = self.sid_key
+
+    def call(self, name: str):
+        """
+        Times a call of the underlying API with the 'backend.<name>' timer of the instrumentation
+        """
+        return instrumentation.timer('backend.' + name)
+
+    def read_dacl(self, object_name: str, inherited: bool = False) -> List[Ace]:
+        """
+        :param inherited: also return the ACEs inherited from the parent folders
+        """
+        raise NotImplementedError
+
+    def write_dacl(self, object_name: str, rights_list: List[Ace], flags: int = OBJECT_INHERIT_ACE):
+        """
+        Replaces the explicit ACEs of the object
+        :param flags: inheritance flags of every ACE, by default the ACEs of a folder
+        are inherited by its files only, CONTAINER_INHERIT_ACE passes them to the subfolders too
+        """
+        raise NotImplementedError
+
+    def create_principal(self, name: str):
+        raise NotImplementedError
+
+    def delete_principal(self, name: str):
+        raise NotImplementedError
+
+    def lookup_name(self, name: str):
+        """
+        :return: SID of the account
+        """
+        raise NotImplementedError
+
+    def lookup_sid(self, sid) -> str:
+        """
+        :return: name of the account
+        """
+        raise NotImplementedError
+
+    def sid_key(self, sid):
+        """
+        :return: hashable key of the SID for the SID cache
+        """
+        return sid
+
+    def resolve_name(self, name: str):
+        return self.sid_cache.sid(name, self.lookup_name)
+
+    def resolve_sid(self, sid) -> str:
+        return self.sid_cache.name(sid, self.lookup_sid)
+
+    def warm(self, names: Iterable[str]):
+        """
+        Resolves all the names once, so the ACL operations find them in the cache
+        """
+        for name in names:
+            self.resolve_name(name)
+
+    def set_right(self, object_name: str, rights_list: List[Ace]):
+        self.write_dacl(object_name, self.read_dacl(object_name) + list(rights_list))
+
+    def add_right(self, object_name: str, ace: Ace):
+        self.set_right(object_name, [ace])
+
+    def delete_ace(self, object_path: str, aceInfo: Ace) -> int:
+        """
+        Deletes the first ACE of the account if it is equal to aceInfo
+        :return: number of deleted ACEs
+        """
+        dacl = self.read_dacl(object_path)
+        for ace_no, ace in enumerate(dacl):
+            if ace.name == aceInfo.name:
+                if ace.type == aceInfo.type and ace.right == aceInfo.right:
+                    del dacl[ace_no]
+                    self.write_dacl(object_path, dacl)
+                    return 1
+                return 0
+        return 0
+
+    def file_from_real_file(self, current_dir: str, file_name: str) -> File:
+        rights_list = defaultdict(lambda: 0)
+        for ace in self.read_dacl(os.path.join(current_dir, file_name), inherited=True):
+            if USER_SUBNAME in ace.name:
+                rights_list[ace.name] |= NormalizedRight.normalized_ace(ace)
+
+        res = []
+        for x in rights_list:
+            res.extend(NormalizedRight.real_right(x, NormalizedRight.effective_right(rights_list[x])))
+        return File(file_name, res)
+
+    def read_mask_row(self, path: str, user_index: Dict[str, int], row: np.ndarray):
+        """
+        Fills row with the effective normalized mask of every user, the same masks
+        file_from_real_file gives, accounts missing from user_index are skipped
+        """
+        row[:] = 0
+        for ace in self.read_dacl(path, inherited=True):
+            user = user_index.get(ace.name)
+            if user is not None:
+                row[user] |= NormalizedRight.normalized_ace(ace)
+        row[:] = NormalizedRight.effective_rights(row)
+
+    def dacl_stamp(self, path: str) -> int:
+        """
+        :return: a number which grows when the DACL of the object changes, 0 if the backend can not tell
+        """
+        return 0
+
+    def change_stamp(self, path: str) -> int:
+        """
+        :return: a number which grows when the file or its DACL changes
+        """
+        st = os.stat(path)
+        return max(st.st_mtime_ns, st.st_ctime_ns, self.dacl_stamp(path))
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def make_dir(self, path: str):
+        os.mkdir(path)
+
+    def create_file(self, path: str):
+        with open(path, 'w'): pass
+
+    def clear(self, root: str):
+        """
+        Deletes everything inside root, creates root if it does not exist
+        """
+        if not os.path.exists(root):
+            os.makedirs(root)
+        for obj in os.listdir(root):
+            obj = os.path.join(root, obj)
+            if os.path.isdir(obj):
+                shutil.rmtree(obj)
+            else:
+                os.remove(obj)
+
+
+class WinApi(AclBackend):
+    def __init__(self, sid_cache: SidCache = None):
+        if win32security is None:
+            raise RuntimeError('WinApi backend requires pywin32')
+        super().__init__(sid_cache)
+        self.all_info = win32security.OWNER_SECURITY_INFORMATION | win32security.DACL_SECURITY_INFORMATION
+        self.pwr_sid = self.resolve_name(ADMIN_NAME)
+
+    def sid_key(self, sid) -> str:
+        # PySID objects are not usable as dict keys, their string form is
+        return win32security.ConvertSidToStringSid(sid)
+
+    def read_dacl(self, object_name: str, inherited: bool = False) -> List[Ace]:
+        with self.call('read_dacl'):
+            sd = win32security.GetFileSecurity(object_name, win32security.DACL_SECURITY_INFORMATION)
+        dacl = sd.GetSecurityDescriptorDacl()
+        if dacl is None:
+            return []
+
+        result = []
+        for ace_no in range(0, dacl.GetAceCount()):
+            _ace = dacl.GetAce(ace_no)
+            if inherited or not _ace[0][1] & INHERITED_ACE:
+                result.append(Ace(self.resolve_sid(_ace[2]), self.convert_real_ace_right(_ace[1], _ace[0][0]),
+                                  AceType(_ace[0][0])))
+        return result
+
+    def read_mask_row(self, path: str, user_index: Dict[str, int], row: np.ndarray):
+        with self.call('read_dacl'):
+            sd = win32security.GetFileSecurity(path, win32security.DACL_SECURITY_INFORMATION)
+        dacl = sd.GetSecurityDescriptorDacl()
+        row[:] = 0
+        if dacl is not None:
+            for ace_no in range(0, dacl.GetAceCount()):
+                _ace = dacl.GetAce(ace_no)
+                user = user_index.get(self.resolve_sid(_ace[2]))
+                if user is not None:
+                    row[user] |= NormalizedRight.normalized_right(
+                        AceType(_ace[0][0]), self.convert_real_ace_right(_ace[1], _ace[0][0]))
+        row[:] = NormalizedRight.effective_rights(row)
+
+    def write_dacl(self, object_name: str, rights_list: List[Ace], flags: int = OBJECT_INHERIT_ACE):
+        dacl = win32security.ACL()
+        self.add_aces(dacl, rights_list, flags)
+        with self.call('write_dacl'):
+            win32security.SetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info,
+                                               self.pwr_sid, self.pwr_sid, dacl, None)
+
+    def add_aces(self, dacl, rights_list: List[Ace], flags: int = OBJECT_INHERIT_ACE):
+        for ace in rights_list:
+            sid = self.resolve_name(ace.name)
+            if ace.type == AceType.ALLOWED:
+                dacl.AddAccessAllowedAceEx(dacl.GetAclRevision(), flags, ace.right, sid)
+            if ace.type == AceType.DENIED:
+                dacl.AddAccessDeniedAceEx(dacl.GetAclRevision(), flags, ace.right, sid)
+
+    def set_right(self, object_name: str, rights_list: List[Ace]):
+        with self.call('read_dacl'):
+            sd = win32security.GetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info)
+        dacl = sd.GetSecurityDescriptorDacl()
+        if dacl is None:
+            dacl = win32security.ACL()
+
+        self.add_aces(dacl, rights_list)
+        with self.call('write_dacl'):
+            win32security.SetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info,
+                                               self.pwr_sid, self.pwr_sid, dacl, None)
+
+    def delete_ace(self, object_path: str, aceInfo: Ace) -> int:
+        with self.call('read_dacl'):
+            sd = win32security.GetFileSecurity(object_path, self.all_info)
+        dacl = sd.GetSecurityDescriptorDacl()
+        if dacl is None:
+            return 0
+        else:
+            for ace_no in range(0, dacl.GetAceCount()):
+                _ace = dacl.GetAce(ace_no)
+                ace = Ace(self.resolve_sid(_ace[2]),
+                          self.convert_real_ace_right(_ace[1], _ace[0][0]),
+                          AceType(_ace[0][0]))
+                if ace.name == aceInfo.name:
+                    if ace.type == aceInfo.type and ace.right == aceInfo.right:
+                        dacl.DeleteAce(ace_no)
+                        with self.call('write_dacl'):
+                            win32security.SetNamedSecurityInfo(object_path, win32security.SE_FILE_OBJECT,
+                                                               self.all_info, self.pwr_sid, self.pwr_sid, dacl, None)
+                        return 1
+                    return 0
+            return 0
+
+    def create_principal(self, name: str):
+        self.delete_principal(name)
+        d = {
+            'name': name,
+            'password': 'testPassword',
+            'priv': win32netcon.USER_PRIV_USER,
+            'comment': "User for labs",
+            'flags': win32netcon.UF_NORMAL_ACCOUNT | win32netcon.UF_SCRIPT
+        }
+        with self.call('create_principal'):
+            win32net.NetUserAdd(None, 1, d)
+
+    def delete_principal(self, name: str):
+        self.sid_cache.forget(name)
+        try:
+            with self.call('delete_principal'):
+                win32net.NetUserDel(None, name)
+        except win32net.error as e:
+            pass
+
+    def lookup_name(self, name: str):
+        with self.call('lookup_name'):
+            return win32security.LookupAccountName(None, name)[0]
+
+    def lookup_sid(self, sid) -> str:
+        with self.call('lookup_sid'):
+            return win32security.LookupAccountSid(None, sid)[0]
+
+    @staticmethod
+    def convert_real_ace_right(right: int, type: int) -> int:
+        ace_right = 0
+        if type == ACCESS_ALLOWED_ACE_TYPE:
+            if FILE_GENERIC_READ & right == FILE_GENERIC_READ:
+                ace_right |= GENERIC_READ
+            if FILE_GENERIC_WRITE & right == FILE_GENERIC_WRITE:
+                ace_right |= GENERIC_WRITE | FILE_READ_ATTRIBUTES
+            if FILE_GENERIC_EXECUTE & right == FILE_GENERIC_EXECUTE:
+                ace_right |= GENERIC_EXECUTE
+        else:
+            if FILE_READ_DATA & right == FILE_READ_DATA:
+                ace_right |= FILE_READ_DATA
+            if FILE_WRITE_DATA & right == FILE_WRITE_DATA:
+                ace_right |= FILE_WRITE_DATA
+            if FILE_EXECUTE & right == FILE_EXECUTE:
+                ace_right |= FILE_EXECUTE
+
+        return ace_right
+
+
+# stored ACE: (sid, right, ace type, inheritance flags)
+StoredAce = Tuple[str, int, int, int]
+
+
+class SimulatedBackend(AclBackend):
+    """
+    DACLs keyed by SID with NTFS-like inheritance: a file gets the ACEs of its
+    folder marked OBJECT_INHERIT_ACE, a folder those marked CONTAINER_INHERIT_ACE.
+    Every call of the API is counted in self.calls.
+    Subclasses store the objects and the principals.
+    """
+
+    def __init__(self, sid_cache: SidCache = None):
+        super().__init__(sid_cache)
+        self.calls = Counter()
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def call(self, name: str):
+        """
+        Counts the call, calls are serialized so the backend can be used from many threads
+        """
+        with self.lock, super().call(name):
+            self.calls[name] += 1
+            yield
+
+    def _load(self, path: str) -> List[StoredAce]:
+        raise NotImplementedError
+
+    def _store(self, path: str, aces: List[StoredAce]):
+        raise NotImplementedError
+
+    def _is_dir(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def _principals(self) -> Dict[str, str]:
+        """
+        :return: name -> SID of every principal
+        """
+        raise NotImplementedError
+
+    def _store_principal(self, name: str, sid: str = None):
+        """
+        Adds the principal, or deletes it when sid is None
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def _inherited(self, path: str, is_dir: bool) -> List[StoredAce]:
+        parent = os.path.dirname(path)
+        if parent == path or not self._is_dir(parent):
+            return []
+        aces = self._load(parent) + self._inherited(parent, True)
+        flag = CONTAINER_INHERIT_ACE if is_dir else OBJECT_INHERIT_ACE
+        return [ace for ace in aces if ace[3] & flag]
+
+    def read_dacl(self, object_name: str, inherited: bool = False) -> List[Ace]:
+        with self.call('read_dacl'):
+            key = self._key(object_name)
+            aces = self._load(key)
+            if inherited:
+                aces = aces + self._inherited(key, self._is_dir(key))
+            return [Ace(self.resolve_sid(sid), right, AceType(type)) for sid, right, type, flags in aces]
+
+    def read_mask_row(self, path: str, user_index: Dict[str, int], row: np.ndarray):
+        with self.call('read_dacl'):
+            key = self._key(path)
+            row[:] = 0
+            for sid, right, type, flags in self._load(key) + self._inherited(key, self._is_dir(key)):
+                user = user_index.get(self.resolve_sid(sid))
+                if user is not None:
+                    row[user] |= NormalizedRight.normalized_right(AceType(type), right)
+            row[:] = NormalizedRight.effective_rights(row)
+
+    def write_dacl(self, object_name: str, rights_list: List[Ace], flags: int = OBJECT_INHERIT_ACE):
+        with self.call('write_dacl'):
+            aces = [(self.resolve_name(ace.name), ace.right, ace.type.value, flags) for ace in rights_list]
+            self._store(self._key(object_name), aces)
+
+    def create_principal(self, name: str):
+        with self.call('create_principal'):
+            principals = self._principals()
+            if name not in principals:
+                self._store_principal(name, 'S-1-5-21-1000-{}'.format(1000 + len(principals)))
+
+    def delete_principal(self, name: str):
+        with self.call('delete_principal'):
+            self.sid_cache.forget(name)
+            self._store_principal(name)
+
+    def lookup_name(self, name: str) -> str:
+        with self.call('lookup_name'):
+            principals = self._principals()
+            if name not in principals:
+                raise ValueError('No mapping between account name and SID: {}'.format(name))
+            return principals[name]
+
+    def lookup_sid(self, sid: str) -> str:
+        with self.call('lookup_sid'):
+            for name, principal_sid in self._principals().items():
+                if principal_sid == sid:
+                    return name
+            raise ValueError('No mapping between SID and account name: {}'.format(sid))
+
+
+class MemoryBackend(SimulatedBackend):
+    """
+    Objects, DACLs and principals live in dictionaries, nothing touches the disk.
+    """
+
+    def __init__(self, sid_cache: SidCache = None):
+        super().__init__(sid_cache)
+        self.objects = {}  # path -> explicit ACEs
+        self.dirs = set()
+        self.principals = {}  # name -> SID
+
+    def _load(self, path: str) -> List[StoredAce]:
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        return list(self.objects[path])
+
+    def _store(self, path: str, aces: List[StoredAce]):
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        self.objects[path] = list(aces)
+
+    def _is_dir(self, path: str) -> bool:
+        return path in self.dirs
+
+    def _principals(self) -> Dict[str, str]:
+        return self.principals
+
+    def _store_principal(self, name: str, sid: str = None):
+        if sid is None:
+            self.principals.pop(name, None)
+        else:
+            self.principals[name] = sid
+
+    def _add(self, path: str, is_dir: bool):
+        key = self._key(path)
+        if key in self.objects:
+            raise FileExistsError(path)
+        if not self._is_dir(os.path.dirname(key)):
+            raise FileNotFoundError(os.path.dirname(key))
+        self.objects[key] = []
+        if is_dir:
+            self.dirs.add(key)
+
+    def exists(self, path: str) -> bool:
+        with self.call('exists'):
+            return self._key(path) in self.objects
+
+    def make_dir(self, path: str):
+        with self.call('make_dir'):
+            self._add(path, True)
+
+    def create_file(self, path: str):
+        with self.call('create_file'):
+            self._add(path, False)
+
+    def clear(self, root: str):
+        with self.call('clear'):
+            root = self._key(root)
+            prefix = os.path.join(root, '')
+            for path in [path for path in self.objects if path.startswith(prefix)]:
+                del self.objects[path]
+                self.dirs.discard(path)
+            # the parents of root are created as well
+            while root not in self.objects:
+                self.objects[root] = []
+                self.dirs.add(root)
+                root = os.path.dirname(root)
+
+
+class PosixBackend(SimulatedBackend):
+    """
+    Real files and folders under root, their DACLs and the principals are kept
+    in a sidecar SQLite database (root/.acl.sqlite by default).
+    """
+    DATABASE_NAME = '.acl.sqlite'
+    hidden_names = (DATABASE_NAME,)
+
+    def __init__(self, root: str, database: str = None, sid_cache: SidCache = None):
+        super().__init__(sid_cache)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.database = database or os.path.join(self.root, self.DATABASE_NAME)
+        self.connection = sqlite3.connect(self.database, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS dacl '
+                                '(path TEXT PRIMARY KEY, aces TEXT NOT NULL, stamp INTEGER NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS principal (name TEXT PRIMARY KEY, sid TEXT NOT NULL)')
+        self.connection.commit()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def _load(self, path: str) -> List[StoredAce]:
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        row = self.connection.execute('SELECT aces FROM dacl WHERE path = ?', (path,)).fetchone()
+        return [tuple(ace) for ace in json.loads(row[0])] if row else []
+
+    def _store(self, path: str, aces: List[StoredAce]):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO dacl VALUES (?, ?, ?)',
+                                    (path, json.dumps(aces), time.time_ns()))
+
+    def _is_dir(self, path: str) -> bool:
+        return os.path.isdir(path)
+
+    def _principals(self) -> Dict[str, str]:
+        return dict(self.connection.execute('SELECT name, sid FROM principal'))
+
+    def _store_principal(self, name: str, sid: str = None):
+        with self.connection:
+            if sid is None:
+                self.connection.execute('DELETE FROM principal WHERE name = ?', (name,))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO principal VALUES (?, ?)', (name, sid))
+
+    def dacl_stamp(self, path: str) -> int:
+        with self.call('dacl_stamp'):
+            row = self.connection.execute('SELECT stamp FROM dacl WHERE path = ?', (self._key(path),)).fetchone()
+            return row[0] if row else 0
+
+    def exists(self, path: str) -> bool:
+        with self.call('exists'):
+            return super().exists(path)
+
+    def make_dir(self, path: str):
+        with self.call('make_dir'):
+            super().make_dir(path)
+
+    def create_file(self, path: str):
+        with self.call('create_file'):
+            super().create_file(path)
+
+    def clear(self, root: str):
+        with self.call('clear'):
+            root = self._key(root)
+            if not os.path.exists(root):
+                os.makedirs(root)
+            for obj in os.listdir(root):
+                obj = os.path.join(root, obj)
+                if obj == self.database:
+                    continue
+                if os.path.isdir(obj):
+                    shutil.rmtree(obj)
+                else:
+                    os.remove(obj)
+            with self.connection:
+                self.connection.execute("DELETE FROM dacl WHERE path LIKE ? ESCAPE '\\'",
+                                        (os.path.join(root, '').replace('\\', '\\\\').replace('%', '\\%')
+                                         .replace('_', '\\_') + '%',))
+
+
+BACKENDS = {
+    'win32': lambda root, sid_cache: WinApi(sid_cache),
+    'memory': lambda root, sid_cache: MemoryBackend(sid_cache),
+    'posix': lambda root, sid_cache: PosixBackend(root, sid_cache=sid_cache),
+}
+
+
+def create_backend(name: str, root: str, sid_cache: SidCache = None) -> AclBackend:
+    if name not in BACKENDS:
+        raise ValueError('Unknown ACL backend: {}'.format(name))
+    return BACKENDS[name](root, sid_cache)
@@ -0,0 +1,233 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from instrumentation import Instrumentation, MemorySink, set_instrumentation
+from main import MockTest, RealTest
+
+OUTPUT_FILE = 'bench_output.txt'
+# timers of Test.start_test reported as phases, in the order they run
+PHASES = ['generate', 'prepare', 'vectorize', 'k_means', 'scoring', 'save_result']
+# settings shared by all cases, the grid values are put on top
+BASE_CONFIG = {
+    'folders': 100,
+    'probability of inverting': 5,
+    'k-means init': 'k-means++',
+    'k-means engine': 'lloyd',
+    'seed': 0,
+    'deduplicate': True,
+    'workers': 1,
+    'backend': 'memory',
+    'root folder': 'c:/test_dir/',
+    'dry run': False,
+    'apply workers': 1,
+}
+# parameter grids: every combination of the values is a case
+GRIDS = {
+    'quick': {
+        'test': ['mock', 'memory'],
+        'users': [30],
+        'files': [500, 2000],
+        'clusters count': [[50], [100]],
+    },
+    'full': {
+        'test': ['mock', 'memory'],
+        'users': [30, 100],
+        'files': [1000, 10000, 50000],
+        'clusters count': [[100], [500]],
+    },
+}
+TESTS = {
+    'mock': MockTest,
+    'memory': RealTest,
+}
+# relative growth of a median time or a peak memory reported as a regression
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+# absolute drop of the ACE reduction reported as a regression
+REDUCTION_THRESHOLD = 0.01
+# phases faster than this (seconds) are too noisy to be compared with the baseline
+MIN_TIME = 0.01
+
+
+def grid_cases(grid: Dict[str, list]) -> List[dict]:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def case_name(params: dict) -> str:
+    return '{}-u{}-f{}-k{}'.format(params['test'], params['users'], params['files'],
+                                   ','.join(str(count) for count in params['clusters count']))
+
+
+def run_case(params: dict, trace_memory: bool = False) -> dict:
+    """
+    Runs Test.start_test with an Instrumentation collecting the records in a MemorySink
+    :param trace_memory: trace the memory peak of every phase
+    :return: seconds of every phase (summed over its timers), memory peaks of the phases if traced,
+    k-means iterations and ACE counts
+    """
+    config = dict(BASE_CONFIG, users=params['users'], files=params['files'],
+                  **{'clusters count': params['clusters count'], 'real': params['test'] != 'mock'})
+    sink = MemorySink()
+    previous = set_instrumentation(Instrumentation([sink], trace_memory=PHASES if trace_memory else ()))
+    # the tests print their progress and write out.txt into the working directory
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            test = TESTS[params['test']](config)
+            test.start_test()
+        finally:
+            os.chdir(cwd)
+            set_instrumentation(previous).close()
+
+    times = {phase: 0.0 for phase in PHASES}
+    peaks = {}
+    for record in sink.records:
+        if record['type'] == 'timer' and record['name'] in times:
+            times[record['name']] += record['seconds']
+            if 'memory_peak' in record:
+                peaks[record['name']] = max(peaks.get(record['name'], 0), record['memory_peak'])
+    summary = sink.named('summary')[-1]
+    ace_count = min(record['ace_count'] for record in sink.named('ace_count'))
+    run = {
+        'times': times,
+        'peaks': peaks,
+        'iterations': summary['counters'].get('k_means.iterations', 0),
+        'ace_before': int(test.number_of_ace),
+        'ace_after': int(ace_count),
+        'reduction': 1 - ace_count / test.number_of_ace,
+    }
+    if params['test'] != 'mock':
+        run['backend_calls'] = dict(test.backend.calls)
+    return run
+
+
+def bench_case(params: dict, repeats: int = 3, warmup: int = 1, trace_memory: bool = True) -> dict:
+    """
+    Runs the case warmup times without recording, then repeats times for the timings.
+    Peak memory comes from one more run under tracemalloc, so the tracing does not slow the timed runs.
+    """
+    for _ in range(warmup):
+        run_case(params)
+    runs = [run_case(params) for _ in range(repeats)]
+
+    peaks = run_case(params, trace_memory=True)['peaks'] if trace_memory else {}
+
+    last = runs[-1]
+    case = {
+        'name': case_name(params),
+        'params': params,
+        'phases': {},
+        'peak_memory': peaks,
+        'iterations': last['iterations'],
+        'ace_before': last['ace_before'],
+        'ace_after': last['ace_after'],
+        'reduction': last['reduction'],
+    }
+    for phase in PHASES:
+        times = [run['times'][phase] for run in runs]
+        case['phases'][phase] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'times': times,
+        }
+    if 'backend_calls' in last:
+        case['backend_calls'] = last['backend_calls']
+    return case
+
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu count': os.cpu_count(),
+    }
+
+
+def compare(report: dict, baseline: dict, time_threshold: float = TIME_THRESHOLD,
+            memory_threshold: float = MEMORY_THRESHOLD, reduction_threshold: float = REDUCTION_THRESHOLD) -> List[str]:
+    """
+    :return: description of every regression of the report against the baseline,
+    cases missing from the baseline are not compared
+    """
+    baseline_cases = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in report['cases']:
+        old = baseline_cases.get(case['name'])
+        if old is None:
+            continue
+        for phase, timing in case['phases'].items():
+            old_time = old['phases'].get(phase, {}).get('median')
+            if old_time is None or max(old_time, timing['median']) < MIN_TIME:
+                continue
+            if timing['median'] > old_time * (1 + time_threshold):
+                regressions.append('{} {}: {:.4f}s -> {:.4f}s'.format(case['name'], phase, old_time,
+                                                                      timing['median']))
+        for phase, peak in case['peak_memory'].items():
+            old_peak = old.get('peak_memory', {}).get(phase)
+            if old_peak and peak > old_peak * (1 + memory_threshold):
+                regressions.append('{} {} memory: {} -> {} bytes'.format(case['name'], phase, old_peak, peak))
+        if case['reduction'] < old['reduction'] - reduction_threshold:
+            regressions.append('{} reduction: {:.2%} -> {:.2%}'.format(case['name'], old['reduction'],
+                                                                     case['reduction']))
+    return regressions
+
+
+def print_case(case: dict):
+    print('{0}: {1} ({2}) {3:.2%}, iterations {4}'.format(
+        case['name'], case['ace_after'], case['ace_before'], case['reduction'], case['iterations']))
+    for phase, timing in case['phases'].items():
+        peak = case['peak_memory'].get(phase)
+        print('    {0:<12} {1:9.4f}s{2}'.format(phase, timing['median'],
+                                                '' if peak is None else ' {:12d} B'.format(peak)))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Times the phases of the ACL optimisation on parameter grids')
+    parser.add_argument('--grid', choices=sorted(GRIDS), default='quick')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='JSON report')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument('--reduction-threshold', type=float, default=REDUCTION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment(), 'grid': args.grid, 'repeats': args.repeats, 'warmup': args.warmup,
+              'cases': []}
+    for params in grid_cases(GRIDS[args.grid]):
+        case = bench_case(params, args.repeats, args.warmup, not args.no_memory)
+        print_case(case)
+        report['cases'].append(case)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(report, baseline, args.time_threshold, args.memory_threshold, args.reduction_threshold)
+    for regression in regressions:
+        print('Regression: {}'.format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from acl import EFFECTIVE_RIGHTS
+from scoring import mask_histograms, top_masks
+
+ALLOW_PART = 0b000111
+DENY_PART = 0b111000
+
+
+class FolderNode(object):
+    def __init__(self, mask: np.ndarray, files: np.ndarray, file_masks: np.ndarray,
+                 children: List['FolderNode'] = None):
+        """
+        :param mask: normalized mask of the folder ACEs for every user (0 is no ACE)
+        :param files: indexes of the files placed directly in the folder
+        :param file_masks: (files x users) masks the files need with the inherited rights taken into account
+        :param children: subfolders, the files are either all in the folder or all in the subfolders
+        """
+        self.mask = mask
+        self.files = files
+        self.file_masks = file_masks
+        self.children = [] if children is None else children
+
+    def walk(self, inherited: Tuple[np.ndarray, ...] = ()):
+        """
+        :return: (node, masks of its ancestors) of the node and all its subfolders
+        """
+        yield self, inherited
+        for child in self.children:
+            yield from child.walk(inherited + (self.mask,))
+
+
+def folder_masks(masks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Folder mask of a group of files: for every user the most frequent mask, inherited by all the files.
+    A mask shared by only a part of the files is used only if it is an allow mask, the other files
+    get deny bits for the inherited rights they must not have.
+    :param masks: (n x users) masks of the files
+    :return: folder mask of every user, (n x users) masks of the files with the added deny bits
+    """
+    histograms, first = mask_histograms(masks, np.zeros(len(masks), dtype=np.intp), 1, first_appearance=True)
+    top, counts = top_masks(histograms[0], first[0])
+    partial = counts != len(masks)
+    folder = np.where(partial & (top >= 8), 0, top).astype(np.uint8)
+
+    inherited = np.where(partial, folder, 0).astype(np.uint8)
+    new_masks = np.asarray(masks, dtype=np.uint8).copy()
+    new_masks |= (new_masks ^ EFFECTIVE_RIGHTS[new_masks | inherited]) << 3
+    return folder, new_masks
+
+
+def explicit_masks(masks: np.ndarray, inherited: Tuple[np.ndarray, ...]) -> np.ndarray:
+    """
+    :param masks: (n x users) masks of objects
+    :param inherited: folder masks of the ancestors of the objects
+    :return: the masks without the allow and deny parts equal to an inherited one,
+    the ACEs of these parts are inherited and need not be written
+    """
+    result = np.array(masks, dtype=np.uint8)
+    for part in (ALLOW_PART, DENY_PART):
+        aces = result & part
+        inherited_aces = np.zeros(result.shape, dtype=bool)
+        for mask in inherited:
+            inherited_aces |= aces == (mask & part)
+        result[inherited_aces & (aces != 0)] &= ~part & (ALLOW_PART | DENY_PART)
+    return result
+
+
+def explicit_ace_count(masks: np.ndarray, inherited: Tuple[np.ndarray, ...]) -> int:
+    """
+    :param masks: (n x users) masks of objects
+    :param inherited: folder masks of the ancestors of the objects
+    :return: number of ACEs the objects need: an allow and a deny ACE for every mask
+    except the ACEs equal to an inherited one
+    """
+    explicit = explicit_masks(masks, inherited)
+    return int(np.count_nonzero(explicit & ALLOW_PART) + np.count_nonzero(explicit & DENY_PART))
+
+
+def nested_ace_count(nodes: List[FolderNode]) -> int:
+    """
+    :return: ACEs of all folders and files of the layout, the objective of the nested optimisation
+    """
+    count = 0
+    for root in nodes:
+        for node, inherited in root.walk():
+            count += explicit_ace_count(node.mask[None], inherited)
+            count += explicit_ace_count(node.file_masks, inherited + (node.mask,))
+    return count
+
+
+def build_node(mask: np.ndarray, files: np.ndarray, file_masks: np.ndarray, inherited: Tuple[np.ndarray, ...],
+               depth: int, subfolders: int, cluster: Callable[[np.ndarray, int], np.ndarray]) -> Tuple[FolderNode, int]:
+    """
+    Places the files in the folder or in subfolders, whichever needs fewer ACEs.
+    The subfolders are the clusters of the file masks, the rights shared inside a subfolder
+    are hoisted into the subfolder mask, ACEs equal to the ones inherited from above are dropped.
+    :param mask: folder mask
+    :param file_masks: masks of the files with the deny bits for the rights inherited from the folder
+    :param inherited: masks of the folder ancestors
+    :param depth: levels of subfolders allowed below the folder
+    :param subfolders: clusters count of every level
+    :param cluster: (masks, clusters count) -> label of every row
+    :return: node, ACEs of the files and subfolders (not of the folder itself)
+    """
+    inherited = inherited + (mask,)
+    node = FolderNode(mask, files, file_masks)
+    cost = explicit_ace_count(file_masks, inherited)
+    if depth == 0 or len(files) < 2:
+        return node, cost
+
+    labels = cluster(file_masks, min(subfolders, len(files)))
+    clusters = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+    if len(clusters) < 2:
+        return node, cost
+
+    children = []
+    children_cost = 0
+    for members in clusters:
+        child_mask, child_masks = folder_masks(file_masks[members])
+        child, child_cost = build_node(child_mask, files[members], child_masks, inherited, depth - 1, subfolders,
+                                       cluster)
+        children.append(child)
+        children_cost += explicit_ace_count(child_mask[None], inherited) + child_cost
+        if children_cost >= cost:
+            return node, cost
+    empty = np.empty((0, file_masks.shape[1]), dtype=np.uint8)
+    return FolderNode(mask, files[:0], empty, children), children_cost
+
+
+def nest(masks: np.ndarray, clusters: List[List[int]], depth: int = 1, subfolders: int = 4,
+         cluster: Callable[[np.ndarray, int], np.ndarray] = None) -> List[FolderNode]:
+    """
+    :param masks: (n x users) masks of the files
+    :param clusters: files of every top level folder
+    :param depth: levels of folders, 1 is one folder per cluster
+    :param subfolders: clusters count inside a folder
+    :param cluster: (masks, clusters count) -> label of every row, needed for depth > 1
+    :return: top level folders
+    """
+    nodes = []
+    for members in clusters:
+        members = np.asarray(members, dtype=np.intp)
+        mask, file_masks = folder_masks(masks[members])
+        nodes.append(build_node(mask, members, file_masks, (), depth - 1, subfolders, cluster)[0])
+    return nodes
@@ -0,0 +1,257 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, List
+
+# lines of the cProfile statistics kept for a profiled phase
+PROFILE_LINES = 20
+# returned by timer when the instrumentation is disabled
+NULL_TIMER = nullcontext()
+
+
+class Sink(object):
+    """
+    Receives the records of the instrumentation: dicts with 'type' ('timer', 'event' or 'summary') and 'name'
+    """
+
+    def emit(self, record: dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LogSink(Sink):
+    """
+    One log line per record
+    """
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO):
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.level = level
+
+    def emit(self, record: dict):
+        fields = ' '.join('{}={}'.format(key, value) for key, value in record.items()
+                          if key not in ('type', 'name', 'profile'))
+        self.logger.log(self.level, '%s %s %s', record['type'], record['name'], fields)
+        if 'profile' in record:
+            self.logger.log(self.level, '%s', record['profile'])
+
+
+class JsonSink(Sink):
+    """
+    One JSON object per line
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.output = open(file_name, 'a')
+        self.lock = threading.Lock()
+
+    def emit(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.output.write(line + '\n')
+
+    def close(self):
+        self.output.close()
+
+
+class MemorySink(Sink):
+    """
+    Keeps the records in a list, for tests
+    """
+
+    def __init__(self):
+        self.records = []  # type: List[dict]
+
+    def emit(self, record: dict):
+        self.records.append(record)
+
+    def named(self, name: str) -> List[dict]:
+        return [record for record in self.records if record['name'] == name]
+
+
+class Instrumentation(object):
+    """
+    Named timers and counters sent to the sinks. Without sinks it is disabled:
+    timer returns NULL_TIMER and count and event return at once.
+    """
+
+    def __init__(self, sinks: Iterable[Sink] = (), profile: Iterable[str] = (), trace_memory: Iterable[str] = ()):
+        """
+        :param profile: timers run under cProfile, the top of the statistics is added to their records
+        :param trace_memory: timers whose peak of memory traced by tracemalloc is added to their records,
+        these timers should not be nested in each other
+        """
+        self.sinks = list(sinks)
+        self.enabled = bool(self.sinks)
+        self.profile = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.timers = {}  # type: Dict[str, List[float]]
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.started_tracing = False
+        self.profiling = False
+
+    def timer(self, name: str, **fields):
+        if not self.enabled:
+            return NULL_TIMER
+        return self._timer(name, fields)
+
+    @contextmanager
+    def _timer(self, name: str, fields: dict):
+        profiler = None
+        if name in self.profile and not self.profiling:
+            # only one profiler can be active, nested profiled timers are not profiled
+            self.profiling = True
+            profiler = cProfile.Profile()
+        traced = name in self.trace_memory
+        if traced:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        if profiler is not None:
+            profiler.enable()
+        state = {'discard': False}
+        start = time.perf_counter()
+        try:
+            # setting 'discard' drops the measurement
+            yield state
+        finally:
+            elapsed = time.perf_counter() - start
+            record = dict(type='timer', name=name, seconds=elapsed, **fields)
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+                record['profile'] = stream.getvalue()
+            if traced:
+                record['memory_peak'] = tracemalloc.get_traced_memory()[1] - start_memory
+            if not state['discard']:
+                with self.lock:
+                    total = self.timers.setdefault(name, [0, 0.0])
+                    total[0] += 1
+                    total[1] += elapsed
+                self._emit(record)
+
+    def timed(self, name: str, iterable: Iterable):
+        """
+        Yields the items of iterable, the time spent in every next() is measured by the timer name
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.timer(name) as state:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    state['discard'] = True
+                    return
+            yield item
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def event(self, name: str, **fields):
+        if self.enabled:
+            self._emit(dict(type='event', name=name, **fields))
+
+    def _emit(self, record: dict):
+        for sink in self.sinks:
+            sink.emit(record)
+
+    def summary(self) -> dict:
+        """
+        :return: calls and total seconds of every timer, value of every counter
+        """
+        with self.lock:
+            return {
+                'timers': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.timers.items()},
+                'counters': dict(self.counters),
+            }
+
+    def close(self):
+        """
+        Sends the summary to the sinks and closes them
+        """
+        if self.enabled:
+            self._emit(dict(type='summary', name='summary', **self.summary()))
+        for sink in self.sinks:
+            sink.close()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+# sinks selected by 'instrumentation sinks', created with the 'instrumentation file'
+SINKS = {
+    'log': lambda file_name: LogSink(),
+    'json': lambda file_name: JsonSink(file_name),
+    'memory': lambda file_name: MemorySink(),
+}
+
+
+def create_instrumentation(sinks: Iterable[str] = (), file_name: str = None, profile: Iterable[str] = (),
+                           trace_memory: Iterable[str] = ()) -> Instrumentation:
+    sink_objects = []
+    for name in sinks:
+        if name not in SINKS:
+            raise ValueError('Unknown instrumentation sink: {}'.format(name))
+        if name == 'json' and file_name is None:
+            raise ValueError('The json sink needs an instrumentation file')
+        sink_objects.append(SINKS[name](file_name))
+    return Instrumentation(sink_objects, profile, trace_memory)
+
+
+_current = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _current
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> Instrumentation:
+    """
+    :return: the previous instrumentation
+    """
+    global _current
+    previous = _current
+    _current = instrumentation
+    return previous
+
+
+def timer(name: str, **fields):
+    if not _current.enabled:
+        return NULL_TIMER
+    return _current.timer(name, **fields)
+
+
+def timed(name: str, iterable: Iterable):
+    return _current.timed(name, iterable)
+
+
+def count(name: str, value: int = 1):
+    if _current.enabled:
+        _current.count(name, value)
+
+
+def event(name: str, **fields):
+    if _current.enabled:
+        _current.event(name, **fields)
@@ -1,9 +1,18 @@
+import itertools
+import mmap
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 from math import sqrt
-from random import sample
-from collections import defaultdict
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 import numpy as np
 
+from sparse import BLOCK_SIZE, SparseMasks
+
+# elements of one block of a matrix-vector product, small enough to stay in the CPU cache
+VECTOR_BLOCK_SIZE = 1 << 16
+
 
 def distance(a, b):
     if len(a) != len(b):
@@ -11,45 +20,542 @@ def distance(a, b):
     return sqrt(np.sum((a - b) ** 2))
 
 
-def allocate_clusters(vectors, centroids):
-    clusters = defaultdict(list)
-    for vector_index, vector in enumerate(vectors):
-        centroid = min(centroids, key=lambda x: distance(vector, x))
-        clusters[centroids.tolist().index(centroid.tolist())].append(vector_index)
-    return clusters
+def chunk_size(clusters_count: int) -> int:
+    return max(1, BLOCK_SIZE // max(1, clusters_count))
+
+
+def as_matrix(vectors):
+    """
+    :return: SparseMasks as they are, anything else as an ndarray
+    """
+    return vectors if isinstance(vectors, SparseMasks) else np.asarray(vectors)
+
+
+def as_float(block):
+    return block if isinstance(block, SparseMasks) else np.asarray(block, dtype=np.float64)
+
+
+def dense_rows(vectors, indexes) -> np.ndarray:
+    rows = vectors[np.asarray(indexes, dtype=np.intp)]
+    return rows.toarray(np.float64) if isinstance(rows, SparseMasks) else np.asarray(rows, dtype=np.float64)
+
+
+def dot(block, matrix: np.ndarray) -> np.ndarray:
+    return block.dot(matrix) if isinstance(block, SparseMasks) else np.asarray(block, dtype=np.float64) @ matrix
+
+
+def group_sums(vectors, labels: np.ndarray, groups_count: int, weights=None) -> np.ndarray:
+    """
+    :return: (groups x d) sum of the (weighted) vectors of every group
+    """
+    if isinstance(vectors, SparseMasks):
+        return vectors.group_sums(labels, groups_count, weights)
+    sums = np.zeros((groups_count, vectors.shape[1]), dtype=np.float64)
+    step = chunk_size(vectors.shape[1])
+    for start in range(0, len(vectors), step):
+        block = np.asarray(vectors[start:start + step], dtype=np.float64)
+        if weights is not None:
+            block = block * weights[start:start + step, None]
+        block_labels = labels[start:start + step]
+        # one bincount per column is much faster than np.add.at on the rows
+        for column in range(block.shape[1]):
+            sums[:, column] += np.bincount(block_labels, weights=block[:, column], minlength=groups_count)
+    return sums
+
+
+def allocate_clusters(vectors, centroids) -> np.ndarray:
+    """
+    :param vectors: (n x d) matrix
+    :param centroids: (k x d) matrix
+    :return: index of the nearest centroid for every vector
+    """
+    centroids = np.asarray(centroids, dtype=np.float64)
+    if vectors.shape[1] != centroids.shape[1]:
+        raise ValueError('Vectors have different dimensions')
+
+    # |v - c|^2 = |v|^2 - 2 v.c + |c|^2, |v|^2 is the same for every centroid
+    centroids_norm = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.intp)
+    step = chunk_size(len(centroids))
+    for start in range(0, len(vectors), step):
+        labels[start:start + step] = np.argmin(centroids_norm - 2 * dot(vectors[start:start + step], centroids.T),
+                                               axis=1)
+    return labels
+
+
+def get_centroids(vectors, labels: np.ndarray, clusters_count: int, weights=None) -> np.ndarray:
+    """
+    :param weights: multiplicity of every vector (None means 1 for all)
+    :return: centroids of non-empty clusters, ordered by cluster index
+    """
+    sums = group_sums(vectors, labels, clusters_count, weights)
+    counts = np.bincount(labels, weights=weights, minlength=clusters_count)
+    non_empty = counts != 0
+    return sums[non_empty] / counts[non_empty, None]
 
 
 def get_centroid(vectors, members_indexes):
-    return np.sum(vectors[i] for i in members_indexes) / len(members_indexes)
+    return dense_rows(vectors, members_indexes).mean(axis=0)
+
+
+def get_rng(random_state=None) -> np.random.Generator:
+    if isinstance(random_state, np.random.Generator):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def row_keys(vectors) -> np.ndarray:
+    """
+    :return: one hashable/sortable key per uint8 row
+    """
+    if isinstance(vectors, SparseMasks):
+        # (users, masks) of a row, rows of different nnz differ in length
+        return np.array([vectors.indices[start:stop].tobytes() + vectors.data[start:stop].tobytes()
+                         for start, stop in zip(vectors.indptr[:-1], vectors.indptr[1:])], dtype=object)
+    rows = np.ascontiguousarray(vectors, dtype=np.uint8)
+    return rows.view(np.dtype((np.void, rows.shape[1]))).ravel()
 
 
-def get_first_centroids(vectors: List, clusters_count: int):
+def unique_vectors(vectors):
     """
-    :param vectors:
+    :return: distinct vectors, index of the distinct vector for every vector, multiplicity of distinct vectors
+    """
+    _, first_indexes, inverse, counts = np.unique(row_keys(vectors), return_index=True, return_inverse=True,
+                                                  return_counts=True)
+    return vectors[first_indexes], inverse.ravel(), counts
+
+
+def squared_norms(vectors) -> np.ndarray:
+    if isinstance(vectors, SparseMasks):
+        return vectors.squared_norms()
+    result = np.empty(len(vectors), dtype=np.float64)
+    step = chunk_size(vectors.shape[1])
+    for start in range(0, len(vectors), step):
+        block = np.asarray(vectors[start:start + step], dtype=np.float64)
+        result[start:start + step] = np.einsum('ij,ij->i', block, block)
+    return result
+
+
+def squared_distances(vectors, centroid, norms: np.ndarray = None) -> np.ndarray:
+    """
+    :param norms: squared_norms of the vectors, computed if not given
+    """
+    centroid = np.asarray(centroid, dtype=np.float64)
+    if norms is None:
+        norms = squared_norms(vectors)
+    # |v - c|^2 = |v|^2 - 2 v.c + |c|^2
+    if isinstance(vectors, SparseMasks):
+        products = vectors.dot(centroid[:, None])[:, 0]
+    else:
+        products = np.empty(len(vectors), dtype=np.float64)
+        step = max(1, VECTOR_BLOCK_SIZE // max(1, len(centroid)))
+        for start in range(0, len(vectors), step):
+            products[start:start + step] = dot(vectors[start:start + step], centroid)
+    result = norms - 2 * products + centroid @ centroid
+    return np.maximum(result, 0, out=result)
+
+
+def squared_distances_to(vectors, centroids: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """
+    :return: squared distance of every vector to the centroid of its cluster
+    """
+    if isinstance(vectors, SparseMasks):
+        centroids_norm = np.einsum('ij,ij->i', centroids, centroids)
+        result = vectors.squared_norms() - 2 * vectors.row_dot(centroids, labels) + centroids_norm[labels]
+        return np.maximum(result, 0, out=result)
+    result = np.empty(len(vectors), dtype=np.float64)
+    step = max(1, BLOCK_SIZE // max(1, centroids.shape[1]))
+    for start in range(0, len(vectors), step):
+        block = np.asarray(vectors[start:start + step], dtype=np.float64) - centroids[labels[start:start + step]]
+        result[start:start + step] = np.einsum('ij,ij->i', block, block)
+    return result
+
+
+def weighted_choice(cumulative: np.ndarray, rng: np.random.Generator) -> int:
+    return int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
+
+
+def k_means_plus_plus(vectors, clusters_count: int, rng: np.random.Generator, weights=None):
+    """
+    D^2 sampling: every next centroid is chosen with probability proportional
+    to the squared distance to the closest centroid chosen so far.
+    :return: unique centroids (len <= clusters_count)
+    """
+    if weights is None:
+        indexes = [int(rng.integers(len(vectors)))]
+    else:
+        indexes = [weighted_choice(np.cumsum(weights), rng)]
+    # the norms are computed once, every step is then one matrix-vector product
+    norms = squared_norms(vectors)
+    closest = squared_distances(vectors, dense_rows(vectors, indexes[:1])[0], norms)
+    while len(indexes) < clusters_count:
+        cumulative = np.cumsum(closest if weights is None else closest * weights)
+        if cumulative[-1] == 0:
+            # every vector is equal to one of the centroids
+            break
+        index = weighted_choice(cumulative, rng)
+        indexes.append(index)
+        np.minimum(closest, squared_distances(vectors, dense_rows(vectors, [index])[0], norms), out=closest)
+    return dense_rows(vectors, indexes)
+
+
+def distinct_centroids(vectors, clusters_count: int, rng: np.random.Generator, weights=None):
+    """
+    :return: random distinct vectors (len <= clusters_count)
+    """
+    first_indexes = np.unique(row_keys(vectors), return_index=True)[1]
+    chosen = rng.choice(first_indexes, size=min(clusters_count, len(first_indexes)), replace=False)
+    return dense_rows(vectors, np.sort(chosen))
+
+
+INIT_METHODS = {
+    'k-means++': k_means_plus_plus,
+    'distinct': distinct_centroids,
+}
+
+
+def get_first_centroids(vectors, clusters_count: int, init: str = 'k-means++', random_state=None, weights=None):
+    """
+    :param vectors: (n x d) matrix
     :param clusters_count:
+    :param init: one of INIT_METHODS
+    :param random_state: seed or np.random.Generator
+    :param weights: multiplicity of every vector (None means 1 for all)
     :return: unique centroids (len <= clusters_count)
     """
-    centroids = []
-    for i in sample(range(len(vectors)), len(vectors)):
-        if vectors[i] not in centroids:
-            centroids.append(vectors[i])
-        if len(centroids) == clusters_count:
+    if init not in INIT_METHODS:
+        raise ValueError('Unknown init method: {}'.format(init))
+    return INIT_METHODS[init](as_matrix(vectors), clusters_count, get_rng(random_state), weights)
+
+
+class KMeansResult(object):
+    def __init__(self, centroids: np.ndarray, labels: np.ndarray, inertia: float, n_iter: int):
+        """
+        :param centroids: (k x d) centroid of every cluster
+        :param labels: cluster of every vector
+        :param inertia: sum of squared distances of the vectors to their centroids
+        :param n_iter: number of assignment steps, 0 for an incremental update
+        """
+        self.centroids = centroids
+        self.labels = labels
+        self.inertia = inertia
+        self.n_iter = n_iter
+
+    @property
+    def clusters(self) -> Dict[int, List[int]]:
+        return labels_to_clusters(self.labels)
+
+    def __len__(self):
+        return len(self.centroids)
+
+
+def has_converged(new_labels, old_labels):
+    return old_labels is not None and np.array_equal(new_labels, old_labels)
+
+
+def labels_to_clusters(labels: np.ndarray) -> Dict[int, List[int]]:
+    order = np.argsort(labels, kind='stable')
+    cluster_ids, starts = np.unique(labels[order], return_index=True)
+    return {int(cluster_id): members.tolist()
+            for cluster_id, members in zip(cluster_ids, np.split(order, starts[1:]))}
+
+
+def weighted_inertia(vectors, centroids: np.ndarray, labels: np.ndarray, weights=None) -> float:
+    distances = squared_distances_to(vectors, centroids, labels)
+    return float(distances.sum() if weights is None else distances @ weights)
+
+
+def k_means_labels(vectors, clusters_count: int, max_iterations: int = 30, init: str = 'k-means++',
+                   random_state=None, weights=None, initial_centroids=None, callback=None) -> KMeansResult:
+    if initial_centroids is None:
+        _centroids = get_first_centroids(vectors, clusters_count, init, random_state, weights)
+    else:
+        _centroids = np.asarray(initial_centroids, dtype=np.float64)
+    labels = None
+    n_iter = 0
+    for n_iter in range(1, max_iterations + 1):
+        new_labels = allocate_clusters(vectors, _centroids)
+        if has_converged(new_labels, labels):
+            if callback is not None:
+                callback(n_iter, 0.0, weighted_inertia(vectors, _centroids, new_labels, weights))
             break
+        labels = new_labels
+        previous = _centroids
+        _centroids = get_centroids(vectors, labels, len(_centroids), weights)
+        # empty clusters are dropped, so the labels have to be renumbered
+        kept, labels = np.unique(labels, return_inverse=True)
+        if callback is not None:
+            shift = float(np.sqrt(((_centroids - previous[kept]) ** 2).sum(axis=1).max()))
+            callback(n_iter, shift, weighted_inertia(vectors, _centroids, labels, weights))
+    if labels is None:
+        labels = allocate_clusters(vectors, _centroids)
+    return KMeansResult(_centroids, labels, weighted_inertia(vectors, _centroids, labels, weights), n_iter)
+
+
+def k_means(vectors, clusters_count: int, max_iterations: int = 30, init: str = 'k-means++', random_state=None,
+            deduplicate: bool = False, initial_centroids=None, callback=None) -> KMeansResult:
+    """
+    :param deduplicate: cluster distinct vectors weighted by their multiplicity
+    and expand the labels back to all vectors
+    :param initial_centroids: (k x d) centroids to start from instead of init (warm start)
+    :param callback: called after every iteration with (iteration, largest centroid shift, inertia),
+    the inertia of the new centroids costs one more pass over the vectors
+    """
+    _vectors = as_matrix(vectors)
+    if not deduplicate:
+        return k_means_labels(_vectors, clusters_count, max_iterations, init, random_state,
+                              initial_centroids=initial_centroids, callback=callback)
+
+    distinct, inverse, counts = unique_vectors(_vectors)
+    result = k_means_labels(distinct, clusters_count, max_iterations, init, random_state, counts, initial_centroids,
+                            callback)
+    result.labels = result.labels[inverse]
+    return result
+
+
+def k_means_update(previous: KMeansResult, vectors, labels: np.ndarray, changed=None, max_drift: float = 0.1,
+                   **kwargs) -> KMeansResult:
+    """
+    Incremental re-clustering after a part of the vectors changed. The changed vectors are
+    assigned to the nearest existing centroid and only the centroids of the clusters
+    which gained or lost vectors are recomputed, the other clusters keep their labels and centroids.
+    If the mean squared distance to the centroids grows by more than max_drift (relative),
+    the vectors are re-clustered with k_means warm-started from the updated centroids.
+    :param previous: result for the previous vectors
+    :param vectors: (n x d) current vectors
+    :param labels: previous cluster of every current vector, -1 for new vectors
+    :param changed: indexes or a boolean mask of the vectors to reassign (new vectors are always reassigned)
+    :param kwargs: passed to k_means on re-clustering
+    """
+    _vectors = as_matrix(vectors)
+    labels = np.array(labels, dtype=np.intp)
+    reassign = labels < 0
+    if changed is not None:
+        reassign[changed] = True
+    clusters_count = len(previous.centroids)
+
+    # clusters which lost vectors: removed ones or the ones to be reassigned
+    kept = labels[~reassign]
+    previous_counts = np.bincount(previous.labels, minlength=clusters_count)
+    affected = np.bincount(kept, minlength=clusters_count) != previous_counts
+    indexes = np.flatnonzero(reassign)
+    if len(indexes):
+        labels[indexes] = allocate_clusters(_vectors[indexes], previous.centroids)
+        affected[labels[indexes]] = True
+
+    centroids = previous.centroids.copy()
+    members = np.flatnonzero(affected[labels])
+    if len(members):
+        sums = group_sums(_vectors[members], labels[members], clusters_count)
+        counts = np.bincount(labels[members], minlength=clusters_count)
+        non_empty = affected & (counts != 0)
+        # an emptied cluster keeps its centroid, so the labels of the other clusters do not move
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+    inertia = float(squared_distances_to(_vectors, centroids, labels).sum())
+    result = KMeansResult(centroids, labels, inertia, 0)
+    if drift(previous, result) > max_drift:
+        kwargs.pop('initial_centroids', None)
+        return k_means(_vectors, clusters_count, initial_centroids=centroids, **kwargs)
+    return result
+
+
+def drift(previous: KMeansResult, current: KMeansResult) -> float:
+    """
+    :return: relative growth of the mean squared distance of the vectors to their centroids
+    """
+    previous_mean = previous.inertia / max(1, len(previous.labels))
+    current_mean = current.inertia / max(1, len(current.labels))
+    if previous_mean == 0:
+        return 0.0 if current_mean == 0 else float('inf')
+    return current_mean / previous_mean - 1
+
+
+def constant_rate(rate: float) -> Callable[[int, np.ndarray, np.ndarray], np.ndarray]:
+    """
+    :return: learning rate schedule which moves every centroid by rate towards the batch mean
+    """
+    return lambda step, batch_counts, counts: np.full(len(counts), rate)
+
+
+def count_rate(step: int, batch_counts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Learning rate of every centroid is the share of the batch in all vectors assigned to it so far,
+    so a centroid is the running mean of its vectors
+    :param step: number of the batch, starting from 1
+    :param batch_counts: vectors of the batch assigned to every centroid
+    :param counts: vectors assigned to every centroid so far, the batch included
+    """
+    return batch_counts / np.maximum(counts, 1)
 
-    return centroids
 
+def decaying_rate(step: int, batch_counts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Rate 1 / sqrt(step) for every centroid
+    """
+    return np.full(len(counts), 1 / sqrt(step))
+
+
+LEARNING_RATES = {
+    'count': count_rate,
+    'decaying': decaying_rate,
+}
+
+
+def matrix_batches(vectors, batch_size: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    """
+    :return: endless random batches of rows, rows are read in index order to keep memory-mapped reads sequential
+    """
+    while True:
+        indexes = np.sort(rng.choice(len(vectors), size=min(batch_size, len(vectors)), replace=False))
+        yield as_float(vectors[indexes])
 
-def has_converged(new_centroids, old_centroids):
-    return set(tuple(x.tolist()) for x in new_centroids) == set(old_centroids.keys())
 
+def matrix_chunks(vectors) -> Iterator[np.ndarray]:
+    step = max(1, BLOCK_SIZE // max(1, vectors.shape[1]))
+    for start in range(0, len(vectors), step):
+        yield vectors[start:start + step]
+
+
+def chunk_batches(chunks: Callable[[], Iterable], batch_size: int) -> Iterator[np.ndarray]:
+    """
+    :return: endless batches of at most batch_size rows, the chunks are read again after the last one
+    """
+    while True:
+        empty = True
+        for chunk in chunks():
+            for start in range(0, len(chunk), batch_size):
+                empty = False
+                yield as_float(chunk[start:start + batch_size])
+        if empty:
+            return
+
+
+def mini_batch_k_means(vectors, clusters_count: int, batch_size: int = 1024, max_iterations: int = 100,
+                       learning_rate='count', tolerance: float = 1e-4, init: str = 'k-means++',
+                       random_state=None) -> KMeansResult:
+    """
+    Mini-batch k-means: every iteration moves the centroids towards the means of one batch.
+    Only the centroids and their counts stay in memory, the labels are computed by a final streaming pass.
+    :param vectors: (n x d) matrix (memory-mapped works) or a function returning a new iterator
+    of (m x d) chunks on every call
+    :param batch_size: rows per iteration
+    :param max_iterations: number of batches
+    :param learning_rate: name from LEARNING_RATES, a constant rate or a schedule like count_rate
+    :param tolerance: stop when the mean squared shift of the centroids in one iteration is smaller
+    :param init: one of INIT_METHODS, applied to the first batch
+    """
+    rng = get_rng(random_state)
+    if isinstance(learning_rate, str):
+        if learning_rate not in LEARNING_RATES:
+            raise ValueError('Unknown learning rate: {}'.format(learning_rate))
+        schedule = LEARNING_RATES[learning_rate]
+    elif callable(learning_rate):
+        schedule = learning_rate
+    else:
+        schedule = constant_rate(learning_rate)
+    if callable(vectors):
+        chunks = vectors
+        batches = chunk_batches(chunks, batch_size)
+    else:
+        chunks = partial(matrix_chunks, vectors)
+        batches = matrix_batches(vectors, batch_size, rng)
 
-def k_means(vectors: List, clusters_count: int, max_iterations: int = 30):
-    clusters = None
-    _centroids = get_first_centroids(vectors, clusters_count)
-    _vectors = np.array(vectors)
-    for i in range(max_iterations):
-        clusters = allocate_clusters(_vectors, np.array(_centroids))
-        _centroids = list(map(lambda x: get_centroid(_vectors, x), clusters.values()))
-        if has_converged(_centroids, clusters):
+    first = next(batches, None)
+    if first is None:
+        raise ValueError('No vectors')
+    centroids = get_first_centroids(first, clusters_count, init, rng)
+    counts = np.zeros(len(centroids), dtype=np.float64)
+    n_iter = 0
+    for n_iter, batch in enumerate(itertools.chain([first], batches), 1):
+        labels = allocate_clusters(batch, centroids)
+        sums = group_sums(batch, labels, len(centroids))
+        batch_counts = np.bincount(labels, minlength=len(centroids)).astype(np.float64)
+        counts += batch_counts
+        assigned = batch_counts != 0
+        rates = schedule(n_iter, batch_counts, counts)[assigned]
+        means = sums[assigned] / batch_counts[assigned, None]
+        shift = rates[:, None] * (means - centroids[assigned])
+        centroids[assigned] += shift
+        if n_iter >= max_iterations or np.einsum('ij,ij->', shift, shift) / len(centroids) < tolerance:
             break
-    return clusters
+
+    # streaming label pass
+    labels = []
+    inertia = 0.0
+    for chunk in chunks():
+        chunk_labels = allocate_clusters(chunk, centroids)
+        inertia += float(squared_distances_to(chunk, centroids, chunk_labels).sum())
+        labels.append(chunk_labels)
+    labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.intp)
+    return KMeansResult(centroids, labels, inertia, n_iter)
+
+
+# vectors shared with the sweep workers, set by _load_shared_vectors
+_shared_vectors = None
+
+
+def npy_file(vectors):
+    """
+    :return: the .npy file vectors map as a whole (an np.load(mmap_mode=...) result, not a view of it),
+    None for other vectors
+    """
+    if not isinstance(vectors, np.memmap) or not isinstance(vectors.base, mmap.mmap) \
+            or not str(vectors.filename or '').endswith('.npy'):
+        return None
+    with open(vectors.filename, 'rb') as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        else:
+            return None
+        offset = file.tell()
+    if shape != vectors.shape or dtype != vectors.dtype or fortran_order or offset != vectors.offset:
+        return None
+    return vectors.filename
+
+
+def _load_shared_vectors(file_name: str):
+    global _shared_vectors
+    if file_name.endswith('.npz'):
+        _shared_vectors = SparseMasks.load(file_name)
+    else:
+        _shared_vectors = np.load(file_name, mmap_mode='r')
+
+
+def _sweep_task(clusters_count: int, engine: Callable[..., KMeansResult], kwargs: dict) -> Tuple[int, KMeansResult]:
+    return clusters_count, engine(_shared_vectors, clusters_count, **kwargs)
+
+
+def k_means_sweep(vectors, clusters_counts: List[int], workers: int = None, random_state=None,
+                  engine: Callable[..., KMeansResult] = k_means, **kwargs) -> Iterator[Tuple[int, KMeansResult]]:
+    """
+    Runs k_means for every clusters count in a process pool. The vectors are
+    written once to a memory-mapped .npy file which every worker maps read-only
+    (SparseMasks are written to an .npz file which every worker loads).
+    A memmap of a whole .npy file (like the AclStore masks) is mapped by the workers without a copy.
+    :param workers: number of processes (None means os.cpu_count())
+    :param engine: module level clustering function like k_means or mini_batch_k_means
+    :param kwargs: passed to the engine
+    :return: (clusters count, KMeansResult) pairs in the order they are finished
+    """
+    seeds = get_rng(random_state).integers(2 ** 32, size=len(clusters_counts))
+    with tempfile.TemporaryDirectory() as directory:
+        if isinstance(vectors, SparseMasks):
+            file_name = os.path.join(directory, 'vectors.npz')
+            vectors.save(file_name)
+        else:
+            if isinstance(vectors, np.memmap):
+                vectors.flush()
+            file_name = npy_file(vectors)
+            if file_name is None:
+                file_name = os.path.join(directory, 'vectors.npy')
+                np.save(file_name, np.asarray(vectors))
+
+        with ProcessPoolExecutor(workers, initializer=_load_shared_vectors, initargs=(file_name,)) as pool:
+            futures = [pool.submit(_sweep_task, clusters_count, engine, dict(kwargs, random_state=int(seed)))
+                       for clusters_count, seed in zip(clusters_counts, seeds)]
+            for future in as_completed(futures):
+                yield future.result()
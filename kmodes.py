@@ -0,0 +1,111 @@
+from typing import Tuple
+
+import numpy as np
+
+from kmeans import BLOCK_SIZE, KMeansResult, get_first_centroids, has_converged, unique_vectors
+from scoring import mask_histograms, top_masks
+from sparse import to_dense
+
+# number of set bits of every byte
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+# masks packed into one word
+WORD_SIZE = 8
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    :return: number of set bits of every uint64 word
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT[words.view(np.uint8)].reshape(words.shape + (WORD_SIZE,)).sum(axis=-1, dtype=np.uint8)
+
+
+def pack(vectors) -> np.ndarray:
+    """
+    :param vectors: (n x d) uint8 masks
+    :return: (n x ceil(d / 8)) uint64 words, 8 masks per word
+    """
+    vectors = np.asarray(vectors, dtype=np.uint8)
+    words_count = -(-vectors.shape[1] // WORD_SIZE)
+    packed = np.zeros((len(vectors), words_count * WORD_SIZE), dtype=np.uint8)
+    packed[:, :vectors.shape[1]] = vectors
+    return packed.view(np.uint64)
+
+
+def hamming_distances(packed: np.ndarray, packed_modes: np.ndarray) -> np.ndarray:
+    """
+    :param packed: (n x w) packed vectors
+    :param packed_modes: (k x w) packed modes
+    :return: (n x k) number of different bits
+    """
+    return popcount(packed[:, None, :] ^ packed_modes[None, :, :]).sum(axis=-1, dtype=np.int64)
+
+
+def allocate_modes(vectors, modes: np.ndarray, return_distances: bool = False):
+    """
+    :param vectors: (n x d) uint8 masks
+    :param modes: (k x d) uint8 masks
+    :return: index of the nearest mode by Hamming distance for every vector[, the distances]
+    """
+    packed_modes = pack(modes)
+    labels = np.empty(len(vectors), dtype=np.intp)
+    distances = np.empty(len(vectors), dtype=np.int64)
+    step = max(1, BLOCK_SIZE // max(1, packed_modes.size))
+    for start in range(0, len(vectors), step):
+        block = hamming_distances(pack(vectors[start:start + step]), packed_modes)
+        labels[start:start + step] = np.argmin(block, axis=1)
+        distances[start:start + step] = block[np.arange(len(block)), labels[start:start + step]]
+    if return_distances:
+        return labels, distances
+    return labels
+
+
+def get_modes(vectors, labels: np.ndarray, clusters_count: int, weights=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: the most frequent mask of every column in every non-empty cluster, mask of non-empty clusters
+    """
+    histograms = mask_histograms(vectors, labels, clusters_count, weights)
+    non_empty = histograms[:, 0].sum(axis=-1) != 0
+    return top_masks(histograms[non_empty])[0].astype(np.uint8), non_empty
+
+
+def k_modes_labels(vectors, clusters_count: int, max_iterations: int = 30, init: str = 'k-means++',
+                   random_state=None, weights=None, initial_modes=None) -> KMeansResult:
+    if initial_modes is None:
+        modes = get_first_centroids(vectors, clusters_count, init, random_state, weights).astype(np.uint8)
+    else:
+        modes = np.asarray(initial_modes, dtype=np.uint8)
+    labels = None
+    n_iter = 0
+    for n_iter in range(1, max_iterations + 1):
+        new_labels = allocate_modes(vectors, modes)
+        if has_converged(new_labels, labels):
+            break
+        labels = new_labels
+        modes, non_empty = get_modes(vectors, labels, len(modes), weights)
+        # empty clusters are dropped, so the labels have to be renumbered
+        labels = (np.cumsum(non_empty) - 1)[labels]
+    labels, distances = allocate_modes(vectors, modes, return_distances=True)
+    inertia = float(distances.sum() if weights is None else distances @ weights)
+    return KMeansResult(modes, labels, inertia, n_iter)
+
+
+def k_modes(vectors, clusters_count: int, max_iterations: int = 30, init: str = 'k-means++', random_state=None,
+            deduplicate: bool = False, initial_centroids=None) -> KMeansResult:
+    """
+    k-modes for normalized masks: vectors are assigned to the mode with the least number
+    of different right bits (popcount of XOR over rows packed 8 masks per uint64), the mode of
+    a cluster is the most frequent mask of every user. Modes are real masks, so a mode
+    is the ACL its folder can inherit.
+    Same parameters as kmeans.k_means, the inertia is the sum of Hamming distances.
+    """
+    _vectors = to_dense(vectors).astype(np.uint8, copy=False)
+    if not deduplicate:
+        return k_modes_labels(_vectors, clusters_count, max_iterations, init, random_state,
+                              initial_modes=initial_centroids)
+
+    distinct, inverse, counts = unique_vectors(_vectors)
+    result = k_modes_labels(distinct, clusters_count, max_iterations, init, random_state, counts, initial_centroids)
+    result.labels = result.labels[inverse]
+    return result
@@ -0,0 +1,243 @@
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from kmeans import KMeansResult, get_centroids, get_rng, labels_to_clusters, weighted_inertia
+from kmodes import k_modes
+from scoring import histograms_ace_count, mask_histograms, top_masks
+
+# clusters compared with a file (or a cluster) exactly, chosen by the number of users with equal top masks
+CANDIDATES_COUNT = 8
+# files moved between two checks of the time budget
+CHECK_STEP = 64
+
+
+def histograms_cost(histograms: np.ndarray, first: np.ndarray) -> np.ndarray:
+    """
+    :param histograms: (... x users x 64) mask counts
+    :param first: (... x users x 64) first appearance of every mask
+    :return: (...) ACE count of every cluster
+    """
+    return histograms_ace_count(histograms, first).sum(axis=-1)
+
+
+class LocalSearch(object):
+    """
+    Refines clusters by moving single files between clusters, merging and splitting clusters
+    while the ACE count (the objective of Test.result) decreases.
+    The (cluster x user x 64) mask histograms and first appearances are kept up to date, so the cost
+    of a move depends only on the two clusters involved. First appearances are positions
+    row * users + user, the ties are broken like clusters_ace_count does for clusters listed in row order.
+    """
+
+    def __init__(self, masks, labels: np.ndarray, random_state=None):
+        """
+        :param masks: (n x users) normalized masks
+        :param labels: initial cluster of every file
+        """
+        self.masks = np.asarray(masks, dtype=np.uint8)
+        self.labels = np.unique(labels, return_inverse=True)[1].ravel().astype(np.intp)
+        clusters_count = int(self.labels.max()) + 1 if len(self.labels) else 0
+        self.histograms, self.first = mask_histograms(self.masks, self.labels, clusters_count, first_appearance=True)
+        # position of the masks which do not appear in a cluster
+        self.absent = self.masks.size
+        self.costs = histograms_cost(self.histograms, self.first)
+        self.sizes = np.bincount(self.labels, minlength=clusters_count)
+        self.tops = top_masks(self.histograms, self.first)[0]
+        self.users = np.arange(self.masks.shape[1])
+        self.rng = get_rng(random_state)
+
+    @property
+    def ace_count(self) -> int:
+        return int(self.costs.sum())
+
+    @property
+    def clusters(self) -> Dict[int, List[int]]:
+        return labels_to_clusters(self.labels)
+
+    def result(self) -> KMeansResult:
+        """
+        :return: the clusters renumbered without the empty ones, with their centroids
+        """
+        labels = np.unique(self.labels, return_inverse=True)[1].ravel()
+        clusters_count = int(labels.max()) + 1 if len(labels) else 0
+        centroids = get_centroids(self.masks, labels, clusters_count)
+        return KMeansResult(centroids, labels, weighted_inertia(self.masks, centroids, labels), 0)
+
+    def _candidates(self, row: np.ndarray, exclude: int) -> np.ndarray:
+        """
+        :return: non-empty clusters whose top masks agree with the row for the most users
+        """
+        agreement = (self.tops == row).sum(axis=1)
+        agreement[self.sizes == 0] = -1
+        agreement[exclude] = -1
+        count = min(CANDIDATES_COUNT, len(agreement))
+        candidates = np.argpartition(-agreement, count - 1)[:count]
+        return candidates[agreement[candidates] >= 0]
+
+    def _update(self, clusters):
+        for cluster in clusters:
+            self.costs[cluster] = histograms_cost(self.histograms[cluster], self.first[cluster])
+            self.tops[cluster] = top_masks(self.histograms[cluster], self.first[cluster])[0]
+
+    def _removed_first(self, cluster: int, file_index: int) -> np.ndarray:
+        """
+        :return: first appearances of the cluster without the file
+        """
+        row = self.masks[file_index]
+        first = self.first[cluster].copy()
+        # users for which the file is the first one with its mask, the next file with the mask takes its place
+        users = self.users[first[self.users, row] == file_index * len(self.users) + self.users]
+        if len(users) == 0:
+            return first
+        first[users, row[users]] = self.absent
+        members = np.flatnonzero(self.labels == cluster)
+        members = members[members != file_index]
+        if len(members) == 0:
+            return first
+        equal = self.masks[members[:, None], users] == row[users]
+        found = equal.any(axis=0)
+        users = users[found]
+        first[users, row[users]] = members[equal.argmax(axis=0)[found]] * len(self.users) + users
+        return first
+
+    def move(self, file_index: int) -> int:
+        """
+        Moves the file to the cluster with the best cost delta if it is negative
+        :return: the cost delta
+        """
+        source = self.labels[file_index]
+        row = self.masks[file_index]
+        candidates = self._candidates(row, source)
+        if len(candidates) == 0:
+            return 0
+
+        removed = self.histograms[source].copy()
+        removed[self.users, row] -= 1
+        removed_first = self._removed_first(source, file_index)
+        delta = histograms_cost(removed, removed_first) - self.costs[source]
+        added = self.histograms[candidates]
+        added[:, self.users, row] += 1
+        added_first = self.first[candidates]
+        added_first[:, self.users, row] = np.minimum(added_first[:, self.users, row],
+                                                     file_index * len(self.users) + self.users)
+        deltas = delta + histograms_cost(added, added_first) - self.costs[candidates]
+        best = int(np.argmin(deltas))
+        if deltas[best] >= 0:
+            return 0
+
+        target = candidates[best]
+        self.histograms[source] = removed
+        self.histograms[target] = added[best]
+        self.first[source] = removed_first
+        self.first[target] = added_first[best]
+        self.sizes[source] -= 1
+        self.sizes[target] += 1
+        self.labels[file_index] = target
+        self._update((source, target))
+        return int(deltas[best])
+
+    def merge(self, cluster: int) -> int:
+        """
+        Merges the cluster into the cluster with the best cost delta if it is negative
+        :return: the cost delta
+        """
+        candidates = self._candidates(self.tops[cluster], cluster)
+        if len(candidates) == 0:
+            return 0
+        merged = self.histograms[candidates] + self.histograms[cluster]
+        merged_first = np.minimum(self.first[candidates], self.first[cluster])
+        deltas = histograms_cost(merged, merged_first) - self.costs[candidates] - self.costs[cluster]
+        best = int(np.argmin(deltas))
+        if deltas[best] >= 0:
+            return 0
+
+        target = candidates[best]
+        self.histograms[target] = merged[best]
+        self.histograms[cluster] = 0
+        self.first[target] = merged_first[best]
+        self.first[cluster] = self.absent
+        self.sizes[target] += self.sizes[cluster]
+        self.sizes[cluster] = 0
+        self.labels[self.labels == cluster] = target
+        self._update((cluster, target))
+        return int(deltas[best])
+
+    def split(self, cluster: int) -> int:
+        """
+        Splits the cluster in two with k_modes if it decreases the cost
+        :return: the cost delta
+        """
+        members = np.flatnonzero(self.labels == cluster)
+        if len(members) < 2:
+            return 0
+        parts = k_modes(self.masks[members], 2, random_state=self.rng, deduplicate=True).labels
+        if parts.min() == parts.max():
+            return 0
+        histograms, first = mask_histograms(self.masks[members], parts, 2, first_appearance=True)
+        # positions inside the members back to positions inside the masks
+        found = first < len(members) * len(self.users)
+        rows = members[np.where(found, first, 0) // len(self.users)]
+        first = np.where(found, rows * len(self.users) + first % len(self.users), self.absent)
+        delta = int(histograms_cost(histograms, first).sum() - self.costs[cluster])
+        if delta >= 0:
+            return 0
+
+        empty = np.flatnonzero(self.sizes == 0)
+        if len(empty):
+            new_cluster = int(empty[0])
+        else:
+            new_cluster = len(self.sizes)
+            self.histograms = np.concatenate([self.histograms, np.zeros_like(self.histograms[:1])])
+            self.first = np.concatenate([self.first, np.full_like(self.first[:1], self.absent)])
+            self.costs = np.append(self.costs, 0)
+            self.sizes = np.append(self.sizes, 0)
+            self.tops = np.concatenate([self.tops, np.zeros_like(self.tops[:1])])
+        self.histograms[cluster] = histograms[0]
+        self.histograms[new_cluster] = histograms[1]
+        self.first[cluster] = first[0]
+        self.first[new_cluster] = first[1]
+        self.sizes[cluster] = np.count_nonzero(parts == 0)
+        self.sizes[new_cluster] = np.count_nonzero(parts == 1)
+        self.labels[members[parts == 1]] = new_cluster
+        self._update((cluster, new_cluster))
+        return delta
+
+    def run(self, time_budget: float = 1.0, max_passes: int = 10) -> int:
+        """
+        Repeats passes of moves, merges and splits until a pass does not improve the cost,
+        max_passes are done or time_budget seconds are spent
+        :return: the cost delta
+        """
+        deadline = time.monotonic() + time_budget
+        total = 0
+        for _ in range(max_passes):
+            improvement = 0
+            for start, file_index in enumerate(self.rng.permutation(len(self.labels))):
+                if start % CHECK_STEP == 0 and time.monotonic() > deadline:
+                    return total + improvement
+                improvement += self.move(file_index)
+            for cluster in self.rng.permutation(len(self.sizes)):
+                if time.monotonic() > deadline:
+                    return total + improvement
+                if self.sizes[cluster] != 0:
+                    improvement += self.merge(cluster)
+            for cluster in self.rng.permutation(len(self.sizes)):
+                if time.monotonic() > deadline:
+                    return total + improvement
+                if self.sizes[cluster] != 0:
+                    improvement += self.split(cluster)
+            total += improvement
+            if improvement == 0:
+                break
+        return total
+
+
+def local_search(masks, labels: np.ndarray, time_budget: float = 1.0, random_state=None) -> KMeansResult:
+    """
+    :return: LocalSearch.result after LocalSearch.run
+    """
+    search = LocalSearch(masks, labels, random_state)
+    search.run(time_budget)
+    return search.result()
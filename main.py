@@ -1,241 +1,30 @@
+import logging
 import os
-import random
-import shutil
-import string
-import win32net
-import win32security
-from collections import defaultdict
-from copy import deepcopy
-from enum import Enum
-from typing import List
-
-import ntsecuritycon
-import win32con
-import win32netcon
-
-from kmeans import k_means
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from acl import AclMatrix, NormalizedRight
+from backend import USER_SUBNAME, SidCache, create_backend
+import instrumentation
+from hierarchy import FolderNode, explicit_masks, nest, nested_ace_count
+from kmeans import k_means, k_means_sweep, k_means_update, mini_batch_k_means
+from kmodes import k_modes
+from local_search import local_search
+from plan import AclPlan
+from scanner import is_within, scan_tree, tree_matrix
+from scoring import clusters_ace_count
+from sparse import SPARSE_DENSITY, SparseMasks, choose_masks
+from store import AclStore
+from workload import generate_workload, invert_rights
 
 ROOT_FOLDER = 'c:/test_dir/'
-ADMIN_NAME = 'Enot'
-USER_SUBNAME = "LabUser"
-
-
-class AceType(Enum):
-    ALLOWED = ntsecuritycon.ACCESS_ALLOWED_ACE_TYPE
-    DENIED = ntsecuritycon.ACCESS_DENIED_ACE_TYPE
-
-
-class Ace(object):
-    def __init__(self, name: str, right: int, type: AceType = AceType.ALLOWED):
-        self.name = name
-        self.right = right
-        self.type = type
-
-    def __eq__(self, other):
-        if isinstance(other, Ace):
-            return self.name == other.name and self.type == other.type and self.right == other.right
-        raise ValueError
-
-
-class NormalizedRight(object):
-    @staticmethod
-    def normalized_ace(ace: Ace):
-        right = 0b0
-        if ace.type == AceType.ALLOWED:
-            if win32con.GENERIC_READ & ace.right:
-                right |= 0b001
-            if (win32con.GENERIC_WRITE | ntsecuritycon.FILE_READ_ATTRIBUTES) & ace.right:
-                right |= 0b010
-            if win32con.GENERIC_EXECUTE & ace.right:
-                right |= 0b100
-        else:
-            if ntsecuritycon.FILE_READ_DATA & ace.right:
-                right |= 0b001 << 3
-            if ntsecuritycon.FILE_WRITE_DATA & ace.right:
-                right |= 0b010 << 3
-            if ntsecuritycon.FILE_EXECUTE & ace.right:
-                right |= 0b100 << 3
-        return right
-
-    @staticmethod
-    def real_right(user_name: str, normalized_right: int) -> List[Ace]:
-        result = []
-        res_right = NormalizedRight.real_allow_right(normalized_right)
-        if res_right != 0:
-            result.append(Ace(user_name, res_right))
-
-        res_right = NormalizedRight.real_deny_right(normalized_right)
-        if res_right != 0:
-            result.append(Ace(user_name, res_right, AceType.DENIED))
-
-        return result
-
-    @staticmethod
-    def real_allow_right(right):
-        res_right = 0b0
-        if 0b001 & right:
-            res_right |= win32con.GENERIC_READ
-        if 0b010 & right:
-            res_right |= win32con.GENERIC_WRITE | ntsecuritycon.FILE_READ_ATTRIBUTES
-        if 0b100 & right:
-            res_right |= win32con.GENERIC_EXECUTE
-        return res_right
-
-    @staticmethod
-    def real_deny_right(right):
-        res_right = 0b0
-        if (0b001 << 3) & right:
-            res_right |= ntsecuritycon.FILE_READ_DATA
-        if (0b010 << 3) & right:
-            res_right |= ntsecuritycon.FILE_WRITE_DATA
-        if (0b100 << 3) & right:
-            res_right |= ntsecuritycon.FILE_EXECUTE
-        return res_right
-
-    @staticmethod
-    def is_allow(right: int):
-        return right < 8
-
-    @staticmethod
-    def print(right):
-        print("{:0>6b}".format(right))
-
-    @staticmethod
-    def effective_right(right):
-        if right & 0b111000 == 0:
-            return right
-        return right & (0b111000 | (~right) >> 3)
-
-    @staticmethod
-    def is_equal(r1, r2):
-        return (r1 | 0b111000) == (r2 | 0b111000)
-
-
-class WinApi(object):
-    def __init__(self):
-        self.all_info = win32security.OWNER_SECURITY_INFORMATION | win32security.DACL_SECURITY_INFORMATION
-        self.pwr_sid = win32security.LookupAccountName(None, ADMIN_NAME)[0]
-
-    def set_right(self, object_name: str, rights_list: List[Ace]):
-        sd = win32security.GetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info)
-        dacl = sd.GetSecurityDescriptorDacl()
-        if dacl is None:
-            dacl = win32security.ACL()
-
-        for ace in rights_list:
-            sid = win32security.LookupAccountName(None, ace.name)[0]
-            if ace.type == AceType.ALLOWED:
-                dacl.AddAccessAllowedAceEx(dacl.GetAclRevision(), win32con.OBJECT_INHERIT_ACE, ace.right, sid)
-            if ace.type == AceType.DENIED:
-                dacl.AddAccessDeniedAceEx(dacl.GetAclRevision(), win32con.OBJECT_INHERIT_ACE, ace.right, sid)
-        win32security.SetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info, self.pwr_sid,
-                                           self.pwr_sid, dacl, None)
-
-    def add_right(self, object_name: str, ace: Ace):
-        sd = win32security.GetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info)
-        dacl = sd.GetSecurityDescriptorDacl()
-        if dacl is None:
-            dacl = win32security.ACL()
-
-        sid = win32security.LookupAccountName(None, ace.name)[0]
-        if ace.type == AceType.ALLOWED:
-            dacl.AddAccessAllowedAceEx(dacl.GetAclRevision(), win32con.OBJECT_INHERIT_ACE, ace.right, sid)
-        if ace.type == AceType.DENIED:
-            dacl.AddAccessDeniedAceEx(dacl.GetAclRevision(), win32con.OBJECT_INHERIT_ACE, ace.right, sid)
-        win32security.SetNamedSecurityInfo(object_name, win32security.SE_FILE_OBJECT, self.all_info, self.pwr_sid,
-                                           self.pwr_sid, dacl, None)
-
-    def delete_ace(self, object_path: str, aceInfo: Ace):
-        sd = win32security.GetFileSecurity(object_path, self.all_info)
-        dacl = sd.GetSecurityDescriptorDacl()
-        if dacl is None:
-            return 0
-        else:
-            for ace_no in range(0, dacl.GetAceCount()):
-                _ace = dacl.GetAce(ace_no)
-                ace = Ace(win32security.LookupAccountSid(None, _ace[2])[0],
-                          self.convert_real_ace_right(_ace[1], _ace[0][0]),
-                          AceType(_ace[0][0]))
-                if ace.name == aceInfo.name:
-                    if ace.type == aceInfo.type and ace.right == aceInfo.right:
-                        dacl.DeleteAce(ace_no)
-                        win32security.SetNamedSecurityInfo(object_path, win32security.SE_FILE_OBJECT, self.all_info,
-                                                           self.pwr_sid, self.pwr_sid, dacl, None)
-                        return 1
-                    return 0
-
-    @staticmethod
-    def convert_real_ace_right(right: int, type: int) -> int:
-        ace_right = 0
-        if type == 0:
-            if ntsecuritycon.FILE_GENERIC_READ & right == ntsecuritycon.FILE_GENERIC_READ:
-                ace_right |= win32con.GENERIC_READ
-            if ntsecuritycon.FILE_GENERIC_WRITE & right == ntsecuritycon.FILE_GENERIC_WRITE:
-                ace_right |= win32con.GENERIC_WRITE | ntsecuritycon.FILE_READ_ATTRIBUTES
-            if ntsecuritycon.FILE_GENERIC_EXECUTE & right == ntsecuritycon.FILE_GENERIC_EXECUTE:
-                ace_right |= win32con.GENERIC_EXECUTE
-        else:
-            if ntsecuritycon.FILE_READ_DATA & right == ntsecuritycon.FILE_READ_DATA:
-                ace_right |= ntsecuritycon.FILE_READ_DATA
-            if ntsecuritycon.FILE_WRITE_DATA & right == ntsecuritycon.FILE_WRITE_DATA:
-                ace_right |= ntsecuritycon.FILE_WRITE_DATA
-            if ntsecuritycon.FILE_EXECUTE & right == ntsecuritycon.FILE_EXECUTE:
-                ace_right |= ntsecuritycon.FILE_EXECUTE
-
-        return ace_right
-
-    @staticmethod
-    def file_from_real_file(current_dir: str, file_name: str):
-        sd = win32security.GetFileSecurity(os.path.join(current_dir, file_name),
-                                           win32security.DACL_SECURITY_INFORMATION)
-        dacl = sd.GetSecurityDescriptorDacl()
-        if dacl is None:
-            return File(file_name, [])
-        else:
-            rights_list = defaultdict(lambda: 0)
-            for ace_no in range(0, dacl.GetAceCount()):
-                ace = dacl.GetAce(ace_no)
-                user_name = win32security.LookupAccountSid(None, ace[2])[0]
-                if USER_SUBNAME in user_name:
-                    ace = Ace(user_name, WinApi.convert_real_ace_right(ace[1], ace[0][0]), AceType(ace[0][0]))
-                    rights_list[user_name] |= NormalizedRight.normalized_ace(ace)
-
-            res = []
-            for x in rights_list:
-                res.extend(NormalizedRight.real_right(x, NormalizedRight.effective_right(rights_list[x])))
-            return File(file_name, res)
-
-
-class File(object):
-    def __init__(self, name: str, rights_list: List[Ace]):
-        self.name = name
-        self.rights_list = rights_list
-
-    def create_real_file(self, win_api: WinApi):
-        if not os.path.exists(ROOT_FOLDER):
-            os.mkdir(ROOT_FOLDER)
-        file_name = os.path.join(ROOT_FOLDER, self.name)
-        with open(file_name, 'w'): pass
-        win_api.set_right(file_name, self.rights_list)
-
-    def get_user_mask(self, user: str):
-        mask = 0
-        for ace in self.rights_list:
-            if ace.name == user:
-                mask |= NormalizedRight.normalized_ace(ace)
-        return mask
-
-    def change_right(self, user: str, deny_new_right: int):
-        for ace in self.rights_list:
-            if ace.name == user and ace.type == AceType.DENIED:
-                ace.right |= NormalizedRight.real_right(user, deny_new_right)[0].right
-        self.rights_list.extend(NormalizedRight.real_right(user, deny_new_right))
-
-    def get_file_vector(self, objects: List[str]) -> List[int]:
-        res = []
-        for obj in objects:
-            res.append(self.get_user_mask(obj))
-        return res
+# clustering engines selected by 'k-means engine'
+ENGINES = {
+    'lloyd': k_means,
+    'mini-batch': mini_batch_k_means,
+    'k-modes': k_modes,
+}
 
 
 class Test(object):
@@ -243,125 +32,125 @@ class Test(object):
         self.clusters_count = config['clusters count']
         self.prob_inverting = config['probability of inverting']
         self._number_of_ace = None
-
-        self.users = self.generate_users(config['users'])
-        self.files = self.generate_files(config['files'], config['folders'])
-
-    def generate_files(self, files_count: int, folders_count: int) -> List[File]:
-        files = []
-        for _ in range(folders_count):
-            files.extend(self.generate_files_cluster(files_count // folders_count))
-
-        # if files_count % clusters_count != 0 then generating additional files
-        files.extend([self.generate_file() for _ in range(files_count % folders_count)])
-
-        return files
+        self.init = config.get('k-means init', 'k-means++')
+        self.deduplicate = config.get('deduplicate', True)
+        self.workers = config.get('workers', 1)
+        self.engine = config.get('k-means engine', 'lloyd')
+        if self.engine not in ENGINES:
+            raise ValueError('Unknown k-means engine: {}'.format(self.engine))
+        self.batch_size = config.get('batch size', 1024)
+        self.search_time = config.get('local search time')
+        self.sparse_density = config.get('sparse density', SPARSE_DENSITY)
+        self.rng = np.random.default_rng(config.get('seed'))
+        self.best_result = None
+        self.folder_skew = config.get('folder skew', 0.0)
+        self.user_skew = config.get('user skew', 0.0)
+        # folder of every generated file, -1 for the files outside the folders
+        self.folder_labels = None
+
+        with instrumentation.timer('generate'):
+            self.users = self.generate_users(config['users'])
+            self.acl = self.generate_files(config['files'], config['folders'])
+        instrumentation.count('files', len(self.acl))
+        instrumentation.count('users', len(self.users))
+
+    def generate_files(self, files_count: int, folders_count: int) -> AclMatrix:
+        workload = generate_workload(self.users, files_count, folders_count, self.folder_skew, self.user_skew,
+                                     self.rng)
+        self.folder_labels = workload.labels
+        return workload.acl
 
     def start_test(self):
-        for file in self.files:
-            self.probably_invert_rights(file)
+        with instrumentation.timer('prepare'):
+            self.prepare_files()
 
-        vectors = []
-        for file in self.files:
-            vectors.append(file.get_file_vector(self.users))
+        vectors = self.acl.masks
+        # clustering and scoring use CSR masks when most masks are zero
+        with instrumentation.timer('vectorize'):
+            cluster_vectors = choose_masks(vectors, self.sparse_density)
+        if isinstance(cluster_vectors, SparseMasks):
+            print("Sparse masks: {0:.2%} nonzero".format(cluster_vectors.density))
 
         best_result = -10
         best_clusters = {}
-        for i in self.clusters_count:
+        best_position = None
+        for i, k_means_result in instrumentation.timed('k_means', self.sweep(cluster_vectors)):
             print("Number of clusters: ", i)
-            clusters = k_means(vectors, clusters_count=i)
-            res = self.result(clusters, vectors)
-            if res > best_result:
+            instrumentation.count('k_means.iterations', k_means_result.n_iter)
+            clusters = k_means_result.clusters
+            with instrumentation.timer('scoring', clusters_count=i):
+                res = self.result(clusters, cluster_vectors)
+            # on equal results prefer the clusters count listed first in the config
+            position = self.clusters_count.index(i) if i in self.clusters_count else len(self.clusters_count)
+            if res > best_result or (res == best_result and best_position is not None and position < best_position):
                 best_result = res
                 best_clusters = clusters
+                best_position = position
+                self.best_result = k_means_result
+
+        if self.search_time and self.best_result is not None:
+            print("Local search")
+            with instrumentation.timer('local_search'):
+                search_result = local_search(vectors, self.best_result.labels, self.search_time, self.rng)
+            clusters = search_result.clusters
+            with instrumentation.timer('scoring', clusters_count=len(clusters)):
+                res = self.result(clusters, cluster_vectors)
+            # the refined clusters replace the k-means ones only if they need fewer ACEs
+            if res > best_result:
+                best_clusters = clusters
+                self.best_result = search_result
+
+        with instrumentation.timer('save_result'):
+            self.save_result(vectors, best_clusters)
+
+    def prepare_files(self):
+        invert_rights(self.acl.masks, self.prob_inverting, self.rng)
+
+    def engine_kwargs(self) -> dict:
+        if self.engine == 'mini-batch':
+            return dict(init=self.init, batch_size=self.batch_size)
+        return dict(init=self.init, deduplicate=self.deduplicate)
+
+    def sweep(self, vectors):
+        kwargs = self.engine_kwargs()
+        if self.workers == 1:
+            for i in self.clusters_count:
+                if self.engine == 'lloyd' and instrumentation.get_instrumentation().enabled:
+                    kwargs['callback'] = self.iteration_callback(i)
+                yield i, ENGINES[self.engine](vectors, clusters_count=i, random_state=self.rng, **kwargs)
+        else:
+            yield from k_means_sweep(vectors, self.clusters_count, self.workers, self.rng, ENGINES[self.engine],
+                                     **kwargs)
 
-        self.save_result(vectors, best_clusters)
+    @staticmethod
+    def iteration_callback(clusters_count: int):
+        """
+        :return: k_means callback sending every iteration as a 'k_means.iteration' event
+        """
+        def callback(iteration: int, shift: float, inertia: float):
+            instrumentation.event('k_means.iteration', clusters_count=clusters_count, iteration=iteration,
+                                  shift=shift, inertia=inertia)
+        return callback
 
     def generate_users(self, count: int) -> List[str]:
         raise NotImplementedError
 
-    def generate_file(self, ace_list: List[Ace] = None) -> File:
-        if ace_list is None:
-            ace_list = self.generate_ace_list(random.randint(1, len(self.users)))
-        return File("test_file_" + "".join([random.choice(string.ascii_letters) for _ in range(10)]), ace_list)
-
-    def generate_files_cluster(self, count: int) -> List[File]:
-        ace_list = self.generate_ace_list(random.randint(1, len(self.users)))
-        return [
-            File("test_file" + "".join([random.choice(string.ascii_letters) for _ in range(10)]), deepcopy(ace_list))
-            for _ in
-            range(count)]
-
     def save_result(self, vectors, clusters):
         raise NotImplementedError
 
-    def generate_ace_list(self, length: int) -> List[Ace]:
-        users = random.sample(self.users, length)
-        ace_list = []
-        for _ in range(length):
-            ace_list.extend(NormalizedRight.real_right(users.pop(), self.generate_random_right()))
-        return ace_list
-
-    def probably_invert_rights(self, file: File) -> File:
-        for ace in file.rights_list:
-            if random.randint(1, 100) <= self.prob_inverting:
-                if ace.type == AceType.ALLOWED:
-                    ace.type = AceType.DENIED
-                    ace.right = NormalizedRight.real_deny_right(self.generate_random_denied_right())
-                else:
-                    ace.type = AceType.ALLOWED
-                    ace.right = NormalizedRight.real_deny_right(self.generate_random_allowed_right())
-        return file
-
     @property
     def number_of_ace(self):
         if self._number_of_ace is None:
-            self._number_of_ace = 0
-            for file in self.files:
-                self._number_of_ace += len(file.rights_list)
+            self._number_of_ace = self.acl.number_of_ace
         return self._number_of_ace
 
     def result(self, clusters, vectors) -> float:
-        ace_count = 0
-        for cluster in clusters.values():
-            for i in range(len(self.users)):
-                number_aces_for_object = defaultdict(lambda: 0)
-                for vector_index in cluster:
-                    number_aces_for_object[vectors[vector_index][i]] += 1
-                number_aces_for_object = sorted(number_aces_for_object.items(), key=lambda v: v[1], reverse=True)
-
-                inherit_index = 0
-                if number_aces_for_object[inherit_index][0] != 0:
-                    if number_aces_for_object[inherit_index][0] > 7:
-                        if len([vectors[vector_index][i] < 8 for vector_index in cluster]) != 0:
-                            for tmp in number_aces_for_object:
-                                if tmp[0] < 8:
-                                    inherit_index = number_aces_for_object.index(tmp)
-                    ace_count += 1
-                for i in number_aces_for_object[0:inherit_index] + number_aces_for_object[inherit_index + 1:]:
-                    if i[0] == 0:
-                        ace_count += i[1]
-                    else:
-                        ace_count += i[1] * 2
+        ace_count = clusters_ace_count(clusters, vectors)
+        instrumentation.event('ace_count', ace_count=ace_count, number_of_ace=self.number_of_ace)
         print("Possible number of ACE after optimisation: {0} ({1}) {2:.2%}".format(
             ace_count, self.number_of_ace, (1 - ace_count / self.number_of_ace)))
         return 1 - ace_count / self.number_of_ace
 
-    @staticmethod
-    def generate_random_allowed_right():
-        return random.choice([1, 2, 3, 5, 7])
-
-    @staticmethod
-    def generate_random_denied_right():
-        return Test.generate_random_allowed_right() << 3
-
-    @staticmethod
-    def generate_random_right():
-        if random.random() < 0.5:
-            return Test.generate_random_allowed_right()
-        else:
-            return Test.generate_random_denied_right()
-
 
 class MockTest(Test):
     def __init__(self, config: dict):
@@ -372,7 +161,7 @@ class MockTest(Test):
             for centroid, cluster_items in clusters.items():
                 output.write('centroid {}\n'.format(str(centroid)))
                 for vector_index in cluster_items:
-                    output.write('{} {}\n'.format(self.files[vector_index].name, str(vectors[vector_index])))
+                    output.write('{} {}\n'.format(self.acl.names[vector_index], str(vectors[vector_index].tolist())))
 
     def generate_users(self, count: int) -> List[str]:
         return [str(x) for x in range(count)]
@@ -380,33 +169,26 @@ class MockTest(Test):
 
 class RealTest(Test):
     def __init__(self, config: dict):
+        self.root_folder = config.get('root folder', ROOT_FOLDER)
+        self.backend = self.create_backend(config)
+        # a dry run only reads the backend: no principals are created and the root folder is not cleared
+        self.dry_run = config.get('dry run', False)
         super().__init__(config)
-        for obj in os.listdir(ROOT_FOLDER):
-            obj = os.path.join(ROOT_FOLDER, obj)
-            if os.path.isdir(obj):
-                shutil.rmtree(obj)
-            else:
-                os.remove(obj)
+        self.plan_file = config.get('plan file')
+        self.apply_workers = config.get('apply workers', 1)
+        self.folder_depth = config.get('folder depth', 1)
+        self.subfolders_count = config.get('subfolders count', 4)
+        self.file_folders = {}  # type: Dict[int, str]
+        if not self.dry_run:
+            self.backend.clear(self.root_folder)
 
     def generate_users(self, count: int) -> List[str]:
         obj_list = []
         for x in range(count):
             userName = USER_SUBNAME + str(x)
-            try:
-                win32net.NetUserDel(None, userName)
-            except win32net.error as e:
-                pass
-
-            d = {
-                'name': userName,
-                'password': 'testPassword',
-                'priv': win32netcon.USER_PRIV_USER,
-                'comment': "User for labs",
-                'flags': win32netcon.UF_NORMAL_ACCOUNT | win32netcon.UF_SCRIPT
-            }
-            win32net.NetUserAdd(None, 1, d)
+            if not self.dry_run:
+                self.backend.create_principal(userName)
             obj_list.append(userName)
-            # win32net.NetUserDel(self.serverName, userName)
         return obj_list
 
     def save_result(self, vectors, clusters):
@@ -414,73 +196,168 @@ class RealTest(Test):
             for centroid, cluster_items in clusters.items():
                 output.write('centroid {}\n'.format(str(centroid)))
                 for vector_index in cluster_items:
-                    output.write('{} {}\n'.format(self.files[vector_index].name, str(vectors[vector_index])))
-
-        folder_number = 0
-        win_api = WinApi()
-        real_ace_count = 0
-        for cluster in clusters.values():
-            rights_list = []
-            new_file = {}
-            for i in cluster:
-                new_file[i] = deepcopy(self.files[i])
-
-            for i in range(len(self.users)):
-                number_aces_for_object = defaultdict(lambda: 0)
-                for vector_index in cluster:
-                    number_aces_for_object[vectors[vector_index][i]] += 1
-                number_aces_for_object = sorted(number_aces_for_object.items(), key=lambda v: v[1], reverse=True)
-
-                if number_aces_for_object[0][0] != 0:
-                    if number_aces_for_object[0][1] != len(cluster):
-                        # inherit only allowed right
-                        if NormalizedRight.is_allow(number_aces_for_object[0][0]):
-                            for file in new_file.values():
-                                initial_r = file.get_user_mask(self.users[i])
-                                effective_r = NormalizedRight.effective_right(initial_r | number_aces_for_object[0][0])
-                                if initial_r != effective_r:
-                                    new_deny_right = initial_r ^ effective_r
-                                    file.change_right(self.users[i], new_deny_right << 3)
-                            rights_list.extend(NormalizedRight.real_right(self.users[i], number_aces_for_object[0][0]))
-                    else:
-                        rights_list.extend(NormalizedRight.real_right(self.users[i], number_aces_for_object[0][0]))
-
-            real_ace_count += len(rights_list)
-            for i in new_file.values():
-                real_ace_count += len(i.rights_list)
-                i.create_real_file(win_api)
-
-            folder = os.path.join(ROOT_FOLDER, str(folder_number))
-            os.mkdir(folder)
-            folder_number += 1
-            for file_index in cluster:
-                os.rename(os.path.join(ROOT_FOLDER, new_file[file_index].name),
-                          os.path.join(folder, new_file[file_index].name))
-
-                for ace in rights_list:
-                    real_ace_count -= win_api.delete_ace(os.path.join(folder, new_file[file_index].name), ace)
-
-                win_api.set_right(folder, rights_list)
-                self.check_rights(self.files[file_index], folder)
+                    output.write('{} {}\n'.format(self.acl.names[vector_index], str(vectors[vector_index].tolist())))
+
+        plan = self.build_plan(vectors, clusters)
+        if self.plan_file is not None:
+            with open(self.plan_file, 'w') as output:
+                output.write(plan.dumps())
+
+        # resolve every principal once, the plan only hits the cache
+        if not self.dry_run:
+            self.backend.warm(self.users)
+        folder_files = {}
+        for file_index, folder in self.file_folders.items():
+            folder_number = int(os.path.relpath(folder, self.root_folder).split(os.sep)[0])
+            folder_files.setdefault(folder_number, []).append(file_index)
+
+        def verify(folder_number: int):
+            for file_index in folder_files.get(folder_number, []):
+                self.check_rights(file_index, self.file_folders[file_index])
+
+        result = plan.apply(self.backend, dry_run=self.dry_run, workers=self.apply_workers,
+                            verify=None if self.dry_run else verify)
+        if self.dry_run:
+            print("Planned writes: {0} of {1} objects, {2} ACE".format(
+                len(result.writes), len(plan.objects), plan.ace_count))
+            return
+
+        for folder_number, failure in sorted(result.failures.items()):
+            print("Folder {0} failed: {1!r}".format(folder_number, failure))
+        real_ace_count = result.ace_count
         print("Real number of ACE after optimisation: {0} ({1}) {2:.2%}".format(
             real_ace_count, self.number_of_ace, (1 - real_ace_count / self.number_of_ace)))
-
-    def check_rights(self, file: File, current_dir: str):
-        l1 = WinApi.file_from_real_file(current_dir, file.name).get_file_vector(self.users)
-        l2 = file.get_file_vector(self.users)
+        print("SID cache hits: {0}, misses: {1}".format(self.backend.sid_cache.hits, self.backend.sid_cache.misses))
+
+    def create_backend(self, config: dict):
+        sid_cache = SidCache(config.get('sid cache size', 4096), config.get('sid cache ttl'))
+        return create_backend(config.get('backend', 'win32'), self.backend_root(), sid_cache)
+
+    def backend_root(self) -> str:
+        return self.root_folder
+
+    def build_plan(self, vectors, clusters) -> AclPlan:
+        """
+        :return: every cluster in its own folder (split into subfolders down to folder depth),
+        the folder DACL is inherited by the files and subfolders
+        """
+        nodes = nest(vectors, list(clusters.values()), self.folder_depth, self.subfolders_count, self.cluster_labels)
+        if self.folder_depth > 1:
+            ace_count = nested_ace_count(nodes)
+            print("Number of ACE after nested optimisation: {0} ({1}) {2:.2%}".format(
+                ace_count, self.number_of_ace, (1 - ace_count / self.number_of_ace)))
+
+        plan = AclPlan()
+        self.file_folders = {}
+        for folder_number, node in enumerate(nodes):
+            self.add_folder(plan, node, os.path.join(self.root_folder, str(folder_number)), (), folder_number)
+        return plan
+
+    def add_folder(self, plan: AclPlan, node: FolderNode, folder: str, inherited: Tuple[np.ndarray, ...], group: int):
+        """
+        Adds the folder, its files and subfolders, ACEs equal to the inherited ones are not needed
+        :param inherited: folder masks of the ancestors
+        """
+        mask = explicit_masks(node.mask[None], inherited)[0]
+        rights_list = [ace for user in np.flatnonzero(mask)
+                       for ace in NormalizedRight.real_right(self.users[user], int(mask[user]))]
+        plan.add_folder(folder, rights_list, group)
+        inherited = inherited + (node.mask,)
+
+        new_files = self.acl.take(node.files)
+        new_files.masks = explicit_masks(node.file_masks, inherited)
+        for file_index in range(len(new_files)):
+            file = new_files.file(file_index)
+            plan.add_file(os.path.join(folder, file.name), file.rights_list, group)
+            self.file_folders[int(node.files[file_index])] = folder
+        for child_number, child in enumerate(node.children):
+            self.add_folder(plan, child, os.path.join(folder, str(child_number)), inherited, group)
+
+    def cluster_labels(self, masks: np.ndarray, clusters_count: int) -> np.ndarray:
+        return ENGINES[self.engine](masks, clusters_count, random_state=self.rng, **self.engine_kwargs()).labels
+
+    def check_rights(self, file_index: int, current_dir: str):
+        l1 = self.backend.file_from_real_file(current_dir, self.acl.names[file_index]).get_file_vector(self.users)
+        l2 = self.acl.get_file_vector(file_index).tolist()
 
         if l1 != l2:
-            for i in range(len(l1)):
-                assert NormalizedRight.is_equal(l1[i], l2[i])
+            assert NormalizedRight.are_equal(np.array(l1), np.array(l2)).all()
+
+
+class ScanTest(RealTest):
+    """
+    Optimizes the ACLs of an existing tree instead of generated files,
+    the tree is read and the result is written through the same backend
+    """
+
+    def __init__(self, config: dict):
+        self.scan_root = config['scan root']
+        root_folder = config.get('root folder', ROOT_FOLDER)
+        # the root folder is cleared and rewritten, it must not overlap the scanned tree
+        if is_within(root_folder, self.scan_root) or is_within(self.scan_root, root_folder):
+            raise ValueError('Root folder {} overlaps scan root {}'.format(root_folder, self.scan_root))
+        self.scan_workers = config.get('scan workers', 4)
+        self.store = AclStore(config['store']) if config.get('store') else None
+        self.max_drift = config.get('max drift', 0.1)
+        self.paths = []
+        super().__init__(config)
+
+    def backend_root(self) -> str:
+        return self.scan_root
+
+    def generate_users(self, count: int) -> List[str]:
+        return [USER_SUBNAME + str(x) for x in range(count)]
+
+    def generate_files(self, files_count: int, folders_count: int) -> AclMatrix:
+        if self.store is None:
+            acl, self.paths = scan_tree(self.scan_root, self.backend, self.users, self.scan_workers)
+            return acl
+        stats = self.store.update(self.scan_root, self.backend, self.users, self.scan_workers)
+        print('Store {}: {}'.format(self.store.directory, stats))
+        self.paths = self.store.paths
+        return tree_matrix(self.scan_root, self.users, self.store.masks, self.paths)
+
+    def prepare_files(self):
+        pass
+
+    def sweep(self, vectors):
+        clustering = self.store.load_clustering() if self.store is not None else None
+        if clustering is None:
+            yield from super().sweep(vectors)
+            return
+        # the clusters of the last run are updated with the rescanned files instead of a new sweep
+        previous, labels = clustering
+        kwargs = dict(init=self.init, random_state=self.rng, deduplicate=self.deduplicate)
+        yield len(previous), k_means_update(previous, vectors, labels, max_drift=self.max_drift, **kwargs)
+
+    def start_test(self):
+        super().start_test()
+        if self.store is not None and self.best_result is not None:
+            self.store.save_clustering(self.best_result)
+
+
+def create_instrumentation(config: dict) -> instrumentation.Instrumentation:
+    sinks = config.get('instrumentation sinks', [])
+    if 'log' in sinks:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    return instrumentation.create_instrumentation(sinks, config.get('instrumentation file'),
+                                                  config.get('profile phases', []),
+                                                  config.get('trace memory phases', []))
 
 
 def main():
     from test_config import test_config
-    if test_config['real']:
-        test = RealTest(config=test_config)
-    else:
-        test = MockTest(config=test_config)
-    test.start_test()
+    previous = instrumentation.set_instrumentation(create_instrumentation(test_config))
+    try:
+        if test_config.get('scan root'):
+            test = ScanTest(config=test_config)
+        elif test_config['real']:
+            test = RealTest(config=test_config)
+        else:
+            test = MockTest(config=test_config)
+        test.start_test()
+    finally:
+        instrumentation.set_instrumentation(previous).close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,136 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from acl import CONTAINER_INHERIT_ACE, OBJECT_INHERIT_ACE, Ace, AceType
+
+FOLDER_FLAGS = OBJECT_INHERIT_ACE | CONTAINER_INHERIT_ACE
+
+
+class ObjectPlan(object):
+    def __init__(self, path: str, is_dir: bool, rights_list: List[Ace], group: int = 0):
+        """
+        :param group: objects of different groups are disjoint and can be applied concurrently
+        """
+        self.path = path
+        self.is_dir = is_dir
+        self.rights_list = rights_list
+        self.group = group
+
+    def to_dict(self) -> dict:
+        return {
+            'path': self.path,
+            'dir': self.is_dir,
+            'aces': [[ace.name, ace.right, ace.type.name] for ace in self.rights_list],
+            'group': self.group,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ObjectPlan':
+        return cls(d['path'], d['dir'], [Ace(name, right, AceType[type]) for name, right, type in d['aces']],
+                   d.get('group', 0))
+
+
+class ApplyResult(object):
+    def __init__(self):
+        self.writes = []  # type: List[ObjectPlan]
+        self.ace_count = 0  # ACEs of the successfully applied groups
+        self.failures = {}  # type: Dict[int, Exception]
+
+    def merge(self, group: int, writes: List[ObjectPlan], ace_count: int, failure: Exception = None):
+        self.writes.extend(writes)
+        if failure is None:
+            self.ace_count += ace_count
+        else:
+            self.failures[group] = failure
+
+
+class AclPlan(object):
+    """
+    Desired state of folders and files: the explicit DACL of every object.
+    Applying the plan reads every existing object once and writes it at most once,
+    folders are applied before the files and subfolders inside them.
+    The ACEs of a folder are inherited by everything below it.
+    """
+
+    def __init__(self, objects: List[ObjectPlan] = None):
+        self.objects = [] if objects is None else objects
+
+    def add_folder(self, path: str, rights_list: List[Ace], group: int = 0):
+        self.objects.append(ObjectPlan(path, True, rights_list, group))
+
+    def add_file(self, path: str, rights_list: List[Ace], group: int = 0):
+        self.objects.append(ObjectPlan(path, False, rights_list, group))
+
+    def groups(self) -> Dict[int, List[ObjectPlan]]:
+        groups = OrderedDict()
+        for obj in self.objects:
+            groups.setdefault(obj.group, []).append(obj)
+        return groups
+
+    @property
+    def ace_count(self) -> int:
+        return sum(len(obj.rights_list) for obj in self.objects)
+
+    def dumps(self) -> str:
+        return json.dumps([obj.to_dict() for obj in self.objects])
+
+    @classmethod
+    def loads(cls, s: str) -> 'AclPlan':
+        return cls([ObjectPlan.from_dict(d) for d in json.loads(s)])
+
+    @staticmethod
+    def apply_objects(backend, objects: List[ObjectPlan], dry_run: bool = False) -> List[ObjectPlan]:
+        """
+        :param backend: AclBackend
+        :param dry_run: only report the writes
+        :return: objects which are (or would be) written
+        """
+        writes = []
+        for obj in objects:
+            if not backend.exists(obj.path):
+                if not dry_run:
+                    if obj.is_dir:
+                        backend.make_dir(obj.path)
+                    else:
+                        backend.create_file(obj.path)
+                current = []
+            else:
+                current = backend.read_dacl(obj.path)
+            if current != obj.rights_list:
+                writes.append(obj)
+                if not dry_run:
+                    backend.write_dacl(obj.path, obj.rights_list, FOLDER_FLAGS if obj.is_dir else OBJECT_INHERIT_ACE)
+        return writes
+
+    def apply(self, backend, dry_run: bool = False, workers: int = 1,
+              verify: Callable[[int], None] = None) -> ApplyResult:
+        """
+        Applies the groups in a thread pool. A failed group does not stop the others,
+        its exception is collected in the result.
+        :param backend: AclBackend
+        :param dry_run: only report the writes
+        :param workers: number of threads
+        :param verify: called with the group number after the group is applied
+        """
+        def apply_group(group: int, objects: List[ObjectPlan]):
+            writes = []
+            try:
+                writes = self.apply_objects(backend, objects, dry_run)
+                if verify is not None:
+                    verify(group)
+            except Exception as e:
+                return group, writes, 0, e
+            return group, writes, sum(len(obj.rights_list) for obj in objects), None
+
+        result = ApplyResult()
+        groups = self.groups()
+        if workers == 1:
+            for group, objects in groups.items():
+                result.merge(*apply_group(group, objects))
+        else:
+            with ThreadPoolExecutor(workers) as pool:
+                for group_result in pool.map(apply_group, groups.keys(), groups.values()):
+                    result.merge(*group_result)
+        return result
@@ -0,0 +1,160 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from acl import AclMatrix
+
+BATCH_SIZE = 1024
+
+
+class GrowableMasks(object):
+    """
+    (rows x users) uint8 matrix which doubles its capacity when it is full
+    """
+
+    def __init__(self, users_count: int, capacity: int = BATCH_SIZE):
+        self._masks = np.zeros((capacity, users_count), dtype=np.uint8)
+        self.size = 0
+
+    def extend(self, rows: np.ndarray):
+        if self.size + len(rows) > len(self._masks):
+            capacity = max(self.size + len(rows), 2 * len(self._masks))
+            masks = np.zeros((capacity, self._masks.shape[1]), dtype=np.uint8)
+            masks[:self.size] = self._masks[:self.size]
+            self._masks = masks
+        self._masks[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    @property
+    def masks(self) -> np.ndarray:
+        return self._masks[:self.size]
+
+
+def walk(root: str, hidden_names=()) -> Iterator[str]:
+    """
+    :return: paths of all files under root, directories are listed with os.scandir one at a time
+    """
+    directories = [root]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            subdirectories = []
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name in hidden_names:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path
+            # depth-first, in name order
+            directories.extend(reversed(subdirectories))
+
+
+def batches(paths: Iterator[str], batch_size: int) -> Iterator[List[str]]:
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_batch(backend, paths: List[str], user_index: Dict[str, int]) -> np.ndarray:
+    rows = np.zeros((len(paths), len(user_index)), dtype=np.uint8)
+    for row, path in zip(rows, paths):
+        backend.read_mask_row(path, user_index, row)
+    return rows
+
+
+def scan(root: str, backend, users: List[str], workers: int = 4,
+         batch_size: int = BATCH_SIZE) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    Reads the security descriptors of all files under root in a thread pool.
+    At most 2 * workers batches are in flight, batches are returned in walk order.
+    :param backend: AclBackend
+    :return: (paths, (len(paths) x users) masks) batches
+    """
+    user_index = {user: i for i, user in enumerate(users)}
+    with ThreadPoolExecutor(workers) as pool:
+        pending = []
+        for paths in batches(walk(root, backend.hidden_names), batch_size):
+            pending.append((paths, pool.submit(read_batch, backend, paths, user_index)))
+            if len(pending) >= 2 * workers:
+                paths, future = pending.pop(0)
+                yield paths, future.result()
+        for paths, future in pending:
+            yield paths, future.result()
+
+
+def scan_tree(root: str, backend, users: List[str], workers: int = 4, batch_size: int = BATCH_SIZE):
+    """
+    :return: AclMatrix of all files under root (named by tree_names), full paths of the files
+    """
+    masks = GrowableMasks(len(users))
+    all_paths = []
+    for paths, rows in scan(root, backend, users, workers, batch_size):
+        masks.extend(rows)
+        all_paths.extend(paths)
+    return tree_matrix(root, users, masks.masks, all_paths), all_paths
+
+
+def tree_names(root: str, paths: List[str]) -> List[str]:
+    """
+    :return: the paths relative to root with os.sep replaced by '_', unique: a name already taken
+    (a/b_c and a_b/c) gets a '~number' suffix before its extension which is not any other name
+    """
+    names = [os.path.relpath(path, root).replace(os.sep, '_') for path in paths]
+    used = set(names)
+    seen = set()
+    for file_index, name in enumerate(names):
+        if name in seen:
+            base, extension = os.path.splitext(name)
+            number = 1
+            while '{}~{}{}'.format(base, number, extension) in used:
+                number += 1
+            names[file_index] = '{}~{}{}'.format(base, number, extension)
+            used.add(names[file_index])
+        seen.add(name)
+    return names
+
+
+def tree_matrix(root: str, users: List[str], masks: np.ndarray, paths: List[str]) -> AclMatrix:
+    """
+    :return: AclMatrix over masks (not copied) named by tree_names
+    """
+    acl = AclMatrix(users, masks, [None] * len(paths))
+    for file_index, name in enumerate(tree_names(root, paths)):
+        acl.set_name(file_index, name)
+    return acl
+
+
+def is_within(path: str, directory: str) -> bool:
+    """
+    :return: True if path is directory or is inside it
+    """
+    path, directory = os.path.abspath(path), os.path.abspath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+
+def walk_stamps(root: str, backend) -> Iterator[Tuple[str, int]]:
+    """
+    :param backend: AclBackend
+    :return: (path, change stamp) of all files under root in walk order, the stamp of a file
+    is the greatest of its change stamp and the DACL stamps of its folders, so inherited changes are noticed too
+    """
+    directories = [(root, backend.dacl_stamp(root))]
+    while directories:
+        directory, directory_stamp = directories.pop()
+        with os.scandir(directory) as entries:
+            subdirectories = []
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name in backend.hidden_names:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append((entry.path, max(directory_stamp, backend.dacl_stamp(entry.path))))
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, max(directory_stamp, backend.change_stamp(entry.path))
+            directories.extend(reversed(subdirectories))
@@ -0,0 +1,155 @@
+from typing import Dict, List
+import numpy as np
+
+from sparse import BLOCK_SIZE, SparseMasks
+
+# normalized masks use 6 bits
+MASKS_COUNT = 64
+# ACEs needed by one file for a mask: nothing for 0, otherwise an allow and a deny ACE at most
+MASK_WEIGHTS = np.array([1] + [2] * (MASKS_COUNT - 1), dtype=np.int64)
+
+
+def mask_histograms(masks, labels: np.ndarray, clusters_count: int, weights=None, first_appearance: bool = False):
+    """
+    Counts every mask of every user inside every cluster with a single bincount
+    over label * users * 64 + user * 64 + mask.
+    :param masks: (n x users) matrix of normalized masks
+    :param labels: cluster of every row
+    :param weights: multiplicity of every row (None means 1 for all)
+    :param first_appearance: also return the position of the first (row, user) pair having the mask
+    :return: (clusters x users x 64) histograms[, (clusters x users x 64) positions]
+    """
+    rows_count, users_count = masks.shape
+    size = clusters_count * users_count * MASKS_COUNT
+    histograms = np.zeros(size, dtype=np.float64 if weights is not None else np.int64)
+    first = np.full(size, rows_count * users_count, dtype=np.int64) if first_appearance else None
+
+    user_keys = np.arange(users_count, dtype=np.int64) * MASKS_COUNT
+    step = max(1, BLOCK_SIZE // max(1, users_count))
+    for start in range(0, rows_count, step):
+        block = np.asarray(masks[start:start + step], dtype=np.int64)
+        keys = (np.asarray(labels[start:start + step], dtype=np.int64)[:, None] * (users_count * MASKS_COUNT)
+                + user_keys + block).ravel()
+        block_weights = None if weights is None else np.repeat(weights[start:start + step], users_count)
+        histograms += np.bincount(keys, block_weights, minlength=size).astype(histograms.dtype, copy=False)
+        if first is not None:
+            np.minimum.at(first, keys, np.arange(start * users_count, start * users_count + len(keys)))
+
+    shape = (clusters_count, users_count, MASKS_COUNT)
+    if first is None:
+        return histograms.reshape(shape)
+    return histograms.reshape(shape), first.reshape(shape)
+
+
+def mask_ranks(histograms: np.ndarray, first: np.ndarray = None) -> np.ndarray:
+    """
+    :return: rank of every mask, a more frequent mask (or an equally frequent but earlier one) has a greater rank
+    """
+    if first is None:
+        return histograms * (MASKS_COUNT + 1) - np.arange(MASKS_COUNT)
+    return histograms * (int(first.max()) + 1) - first
+
+
+def top_masks(histograms: np.ndarray, first: np.ndarray = None):
+    """
+    :param histograms: (... x 64) mask counts
+    :param first: (... x 64) first appearance of every mask
+    :return: the most frequent mask and its count for every histogram
+    """
+    top = np.argmax(np.where(histograms > 0, mask_ranks(histograms, first), -1), axis=-1)
+    return top, np.take_along_axis(histograms, top[..., None], axis=-1)[..., 0]
+
+
+def histograms_ace_count(histograms: np.ndarray, first: np.ndarray = None) -> np.ndarray:
+    """
+    ACE count of every (cluster, user) pair. The most frequent mask is inherited
+    from the folder; if it is a deny mask the least frequent allow mask is
+    inherited instead (the folder still needs one ACE). Every other file needs
+    an ACE for a zero mask and two ACEs for any other mask.
+    Ties are broken by the first appearance of the mask (by the mask value when
+    first is None), the same way a stable sort by count does.
+    :param histograms: (... x 64) mask counts
+    :param first: (... x 64) first appearance of every mask
+    :return: (...) ACE counts
+    """
+    present = histograms > 0
+    rank = mask_ranks(histograms, first)
+
+    top = np.argmax(np.where(present, rank, -1), axis=-1)
+    allow_present = present[..., :8]
+    least_allow = np.argmin(np.where(allow_present, rank[..., :8], np.inf), axis=-1)
+
+    inherited = np.where((top >= 8) & allow_present.any(axis=-1), least_allow, top)
+    weighted = histograms * MASK_WEIGHTS
+    return (top != 0) + weighted.sum(axis=-1) - np.take_along_axis(weighted, inherited[..., None], axis=-1)[..., 0]
+
+
+def labels_ace_count(masks, labels: np.ndarray, clusters_count: int) -> int:
+    """
+    :return: ACE count for clusters given by a label of every row, rows are taken in index order
+    """
+    if isinstance(masks, SparseMasks):
+        return sparse_labels_ace_count(masks, labels, clusters_count)
+    histograms, first = mask_histograms(masks, labels, clusters_count, first_appearance=True)
+    return int(histograms_ace_count(histograms, first).sum())
+
+
+def sparse_labels_ace_count(masks: SparseMasks, labels: np.ndarray, clusters_count: int) -> int:
+    """
+    labels_ace_count for SparseMasks. A (cluster, user) pair without nonzero masks needs no ACE,
+    so histograms are built only for the pairs of the stored masks: the zero count of a pair
+    is the cluster size minus its nonzero count, and the first zero of a pair is the first row
+    of the cluster missing from its rows.
+    """
+    rows_count, users_count = masks.shape
+    labels = np.asarray(labels, dtype=np.int64)
+    rows = masks.row_ids()
+    pairs, inverse = np.unique(labels[rows] * users_count + masks.indices, return_inverse=True)
+    inverse = inverse.ravel()
+    if len(pairs) == 0:
+        return 0
+
+    keys = inverse * MASKS_COUNT + masks.data
+    histograms = np.bincount(keys, minlength=len(pairs) * MASKS_COUNT).reshape(len(pairs), MASKS_COUNT)
+    first = np.full(len(pairs) * MASKS_COUNT, rows_count * users_count, dtype=np.int64)
+    np.minimum.at(first, keys, rows * users_count + masks.indices)
+    first = first.reshape(len(pairs), MASKS_COUNT)
+
+    # position of every row inside its cluster (rows in index order)
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels, minlength=clusters_count)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    local = np.empty(rows_count, dtype=np.int64)
+    local[order] = np.arange(rows_count) - starts[labels[order]]
+
+    pair_clusters = pairs // users_count
+    histograms[:, 0] = sizes[pair_clusters] - histograms.sum(axis=1)
+    # the elements of a pair ordered by the row position, the first position i holding another row than i
+    # is the first zero of the pair
+    element_order = np.lexsort((local[rows], inverse))
+    pair_starts = np.searchsorted(inverse[element_order], np.arange(len(pairs)))
+    rank = np.arange(len(element_order)) - np.repeat(pair_starts, np.diff(np.append(pair_starts,
+                                                                                      len(element_order))))
+    first_zero = histograms.sum(axis=1) - histograms[:, 0]
+    gaps = local[rows][element_order] != rank
+    np.minimum.at(first_zero, inverse[element_order][gaps], rank[gaps])
+    has_zero = histograms[:, 0] != 0
+    zero_rows = order[starts[pair_clusters[has_zero]] + first_zero[has_zero]]
+    first[has_zero, 0] = zero_rows * users_count + pairs[has_zero] % users_count
+
+    return int(histograms_ace_count(histograms, first).sum())
+
+
+def clusters_ace_count(clusters: Dict[int, List[int]], vectors) -> int:
+    """
+    :param clusters: {cluster: [vector indexes]}
+    :param vectors: (n x users) matrix of normalized masks
+    :return: ACE count after optimisation (the objective of Test.result)
+    """
+    members = [np.asarray(cluster, dtype=np.intp) for cluster in clusters.values() if len(cluster) != 0]
+    if not members:
+        return 0
+    order = np.concatenate(members)
+    labels = np.repeat(np.arange(len(members)), [len(cluster) for cluster in members])
+    vectors = vectors if isinstance(vectors, SparseMasks) else np.asarray(vectors)
+    return labels_ace_count(vectors[order], labels, len(members))
@@ -0,0 +1,149 @@
+import numpy as np
+
+# masks with at most this share of nonzero entries are handled as SparseMasks by choose_masks
+SPARSE_DENSITY = 0.1
+# upper bound for the number of elements processed at once
+BLOCK_SIZE = 1 << 22
+
+
+class SparseMasks(object):
+    """
+    (files x users) normalized masks in CSR form: the users and masks of row i are
+    indices[indptr[i]:indptr[i + 1]] and data[indptr[i]:indptr[i + 1]], zero masks are not stored.
+    Supports the parts of the ndarray interface used by kmeans and scoring: len, shape,
+    row slices and row index arrays.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, masks) -> 'SparseMasks':
+        rows_count, users_count = masks.shape
+        indptr = np.zeros(rows_count + 1, dtype=np.int64)
+        indices = []
+        data = []
+        step = max(1, BLOCK_SIZE // max(1, users_count))
+        for start in range(0, rows_count, step):
+            block = np.asarray(masks[start:start + step], dtype=np.uint8)
+            rows, users = np.nonzero(block)
+            indptr[start + 1:start + len(block) + 1] = np.bincount(rows, minlength=len(block))
+            indices.append(users.astype(np.int32))
+            data.append(block[rows, users])
+        np.cumsum(indptr, out=indptr)
+        return cls(indptr, np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                   np.concatenate(data) if data else np.empty(0, dtype=np.uint8), (rows_count, users_count))
+
+    def save(self, file_name: str):
+        np.savez(file_name, indptr=self.indptr, indices=self.indices, data=self.data, shape=np.array(self.shape))
+
+    @classmethod
+    def load(cls, file_name: str) -> 'SparseMasks':
+        with np.load(file_name) as arrays:
+            return cls(arrays['indptr'], arrays['indices'], arrays['data'], arrays['shape'].tolist())
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1] - self.indptr[0])
+
+    @property
+    def density(self) -> float:
+        return self.nnz / max(1, self.shape[0] * self.shape[1])
+
+    def __getitem__(self, rows) -> 'SparseMasks':
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                indptr = self.indptr[start:stop + 1]
+                begin, end = indptr[0], indptr[-1]
+                return SparseMasks(indptr - begin, self.indices[begin:end], self.data[begin:end],
+                                   (stop - start, self.shape[1]))
+            rows = np.arange(start, stop, step)
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        # position of every taken element in self.data
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseMasks(indptr, self.indices[positions], self.data[positions], (len(rows), self.shape[1]))
+
+    def row_ids(self) -> np.ndarray:
+        """
+        :return: row of every stored element
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def toarray(self, dtype=np.uint8) -> np.ndarray:
+        result = np.zeros(self.shape, dtype=dtype)
+        result[self.row_ids(), self.indices] = self.data
+        return result
+
+    def squared_norms(self) -> np.ndarray:
+        return np.bincount(self.row_ids(), weights=self.data.astype(np.float64) ** 2, minlength=len(self))
+
+    def dot(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: (users x k) dense matrix
+        :return: (files x k) product, computed for blocks of rows with about BLOCK_SIZE products
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        result = np.zeros((len(self), matrix.shape[1]), dtype=np.float64)
+        step = max(1, BLOCK_SIZE // max(1, matrix.shape[1]))
+        start = 0
+        while start < len(self):
+            stop = int(np.searchsorted(self.indptr, self.indptr[start] + step, side='right')) - 1
+            stop = min(len(self), max(start + 1, stop))
+            block = self[start:stop]
+            non_empty = np.flatnonzero(np.diff(block.indptr))
+            if len(non_empty):
+                products = block.data[:, None] * matrix[block.indices]
+                result[start + non_empty] = np.add.reduceat(products, block.indptr[non_empty], axis=0)
+            start = stop
+        return result
+
+    def row_dot(self, matrix: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        """
+        :return: dot product of every row with the row of matrix given by its label
+        """
+        rows = self.row_ids()
+        return np.bincount(rows, weights=self.data * matrix[labels[rows], self.indices], minlength=len(self))
+
+    def group_sums(self, labels: np.ndarray, groups_count: int, weights=None) -> np.ndarray:
+        """
+        :return: (groups x users) sum of the rows of every group
+        """
+        rows = self.row_ids()
+        values = self.data.astype(np.float64) if weights is None else self.data * weights[rows]
+        keys = labels[rows].astype(np.int64) * self.shape[1] + self.indices
+        sums = np.bincount(keys, weights=values, minlength=groups_count * self.shape[1])
+        return sums.reshape(groups_count, self.shape[1])
+
+
+def dense_density(masks) -> float:
+    rows_count, users_count = masks.shape
+    step = max(1, BLOCK_SIZE // max(1, users_count))
+    nonzero = sum(int(np.count_nonzero(masks[start:start + step])) for start in range(0, rows_count, step))
+    return nonzero / max(1, rows_count * users_count)
+
+
+def choose_masks(masks, max_density: float = SPARSE_DENSITY):
+    """
+    :return: SparseMasks if at most max_density of the masks are nonzero, otherwise the dense masks
+    """
+    if isinstance(masks, SparseMasks) or dense_density(masks) > max_density:
+        return masks
+    return SparseMasks.from_dense(masks)
+
+
+def to_dense(masks) -> np.ndarray:
+    return masks.toarray() if isinstance(masks, SparseMasks) else np.asarray(masks)
+
@@ -0,0 +1,148 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from kmeans import KMeansResult
+from scanner import BATCH_SIZE, read_batch, walk_stamps
+
+
+class StoreStats(object):
+    def __init__(self, rescanned: int = 0, reused: int = 0, removed: int = 0):
+        self.rescanned = rescanned
+        self.reused = reused
+        self.removed = removed
+
+    def __repr__(self):
+        return 'rescanned: {}, reused: {}, removed: {}'.format(self.rescanned, self.reused, self.removed)
+
+
+class AclStore(object):
+    """
+    Masks of a scanned tree kept on disk between runs:
+    masks.npy - (files x users) uint8 matrix, loaded with np.load(mmap_mode='r')
+    stamps.npy - change stamp of every file (see walk_stamps)
+    paths.json, users.json - row and column index
+    clustering.npz - the last KMeansResult saved for the rows (optional)
+    Files are rewritten as temporary files and moved over the old ones, so an interrupted
+    update leaves the previous store readable.
+    """
+    MASKS_NAME = 'masks.npy'
+    STAMPS_NAME = 'stamps.npy'
+    PATHS_NAME = 'paths.json'
+    USERS_NAME = 'users.json'
+    CLUSTERING_NAME = 'clustering.npz'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.masks = None  # type: np.ndarray
+        self.stamps = None  # type: np.ndarray
+        self.paths = []  # type: List[str]
+        self.users = []  # type: List[str]
+        # row of every row in the store before the last update, -1 for rescanned rows
+        self.previous_rows = None  # type: np.ndarray
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self) -> bool:
+        return all(os.path.exists(self._file(name))
+                   for name in (self.MASKS_NAME, self.STAMPS_NAME, self.PATHS_NAME, self.USERS_NAME))
+
+    def load(self) -> 'AclStore':
+        """
+        Maps the masks read-only, nothing is read until the rows are used
+        """
+        with open(self._file(self.USERS_NAME)) as f:
+            self.users = json.load(f)
+        with open(self._file(self.PATHS_NAME)) as f:
+            self.paths = json.load(f)
+        self.stamps = np.load(self._file(self.STAMPS_NAME))
+        self.masks = np.load(self._file(self.MASKS_NAME), mmap_mode='r')
+        return self
+
+    def update(self, root: str, backend, users: List[str], workers: int = 4,
+               batch_size: int = BATCH_SIZE) -> StoreStats:
+        """
+        Brings the store in line with the tree under root. Rows of files whose stamp did not change
+        are copied from the old matrix, new and changed files are read through the backend
+        in a thread pool, rows of removed files are dropped. A change of users rescans everything.
+        :param backend: AclBackend
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if self.exists():
+            self.load()
+        old_rows = {}
+        if self.users == list(users):
+            old_rows = {path: i for i, path in enumerate(self.paths)}
+
+        entries = list(walk_stamps(root, backend))
+        paths = [path for path, _ in entries]
+        stamps = np.array([stamp for _, stamp in entries], dtype=np.int64)
+        # row of the file in the old matrix, -1 for new and changed files
+        sources = np.array([old_rows.get(path, -1) for path in paths], dtype=np.int64)
+        known = sources >= 0
+        if known.any():
+            known[known] = self.stamps[sources[known]] == stamps[known]
+        sources[~known] = -1
+
+        masks_file = self._file(self.MASKS_NAME)
+        masks_tmp = masks_file + '.tmp'
+        masks = np.lib.format.open_memmap(masks_tmp, mode='w+', dtype=np.uint8, shape=(len(paths), len(users)))
+        reused = np.flatnonzero(known)
+        for start in range(0, len(reused), batch_size):
+            rows = reused[start:start + batch_size]
+            masks[rows] = self.masks[sources[rows]]
+
+        user_index = {user: i for i, user in enumerate(users)}
+        rescanned = np.flatnonzero(~known)
+        with ThreadPoolExecutor(workers) as pool:
+            batches = [rescanned[start:start + batch_size] for start in range(0, len(rescanned), batch_size)]
+            futures = [pool.submit(read_batch, backend, [paths[i] for i in rows], user_index) for rows in batches]
+            for rows, future in zip(batches, futures):
+                masks[rows] = future.result()
+        masks.flush()
+        del masks
+
+        removed = len(set(self.paths).difference(paths))
+        self._replace(self.STAMPS_NAME, lambda f: np.save(f, stamps), binary=True)
+        self._replace(self.PATHS_NAME, lambda f: json.dump(paths, f))
+        self._replace(self.USERS_NAME, lambda f: json.dump(list(users), f))
+        self.masks = None
+        os.replace(masks_tmp, masks_file)
+        if not old_rows and os.path.exists(self._file(self.CLUSTERING_NAME)):
+            os.remove(self._file(self.CLUSTERING_NAME))
+        self.load()
+        self.previous_rows = sources
+        return StoreStats(len(rescanned), len(reused), removed)
+
+    def _replace(self, name: str, write, binary: bool = False):
+        file_name = self._file(name)
+        with open(file_name + '.tmp', 'wb' if binary else 'w') as f:
+            write(f)
+        os.replace(file_name + '.tmp', file_name)
+
+    def save_clustering(self, result: KMeansResult):
+        """
+        :param result: clustering of the current rows
+        """
+        self._replace(self.CLUSTERING_NAME, lambda f: np.savez(f, centroids=result.centroids, labels=result.labels,
+                                                                 inertia=result.inertia, n_iter=result.n_iter),
+                      binary=True)
+
+    def load_clustering(self):
+        """
+        :return: the saved KMeansResult and the previous label of every current row (-1 for rescanned rows),
+        None if nothing is saved
+        """
+        file_name = self._file(self.CLUSTERING_NAME)
+        if not os.path.exists(file_name) or self.previous_rows is None:
+            return None
+        with np.load(file_name) as data:
+            result = KMeansResult(data['centroids'], data['labels'], float(data['inertia']), int(data['n_iter']))
+        known = self.previous_rows >= 0
+        labels = np.full(len(self.previous_rows), -1, dtype=np.intp)
+        labels[known] = result.labels[self.previous_rows[known]]
+        return result, labels
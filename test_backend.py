@@ -0,0 +1,42 @@
+from acl import Ace, AceType
+from backend import MemoryBackend, SidCache
+
+
+class UnhashableSidBackend(MemoryBackend):
+    """
+    Returns SIDs as lists, unhashable like the PySID objects of WinApi
+    """
+
+    def lookup_name(self, name: str):
+        return list(super().lookup_name(name))
+
+    def lookup_sid(self, sid) -> str:
+        return super().lookup_sid(''.join(sid))
+
+    def sid_key(self, sid) -> str:
+        return ''.join(sid)
+
+
+def test_sid_cache_uses_the_backend_sid_key():
+    # built like RealTest.create_backend builds it, without a sid_key
+    backend = UnhashableSidBackend(SidCache(16))
+    assert backend.sid_cache.sid_key == backend.sid_key
+    backend.create_principal('user')
+    sid = backend.resolve_name('user')
+    assert backend.resolve_sid(list(sid)) == 'user'
+    assert backend.sid_cache.misses == 1
+
+
+def test_explicit_sid_key_is_kept():
+    sid_cache = SidCache(16, sid_key=str)
+    assert MemoryBackend(sid_cache).sid_cache.sid_key is str
+
+
+def test_write_and_read_dacl():
+    backend = MemoryBackend()
+    backend.create_principal('user')
+    backend.clear('/root')
+    backend.create_file('/root/file')
+    rights_list = [Ace('user', 1), Ace('user', 2, AceType.DENIED)]
+    backend.write_dacl('/root/file', rights_list)
+    assert backend.read_dacl('/root/file') == rights_list
@@ -4,5 +4,32 @@ test_config = {
     'folders': 100,
     'clusters count': [100],
     'probability of inverting': 5,
-    'real': True
+    'folder skew': 0.0,
+    'user skew': 0.0,
+    'k-means init': 'k-means++',
+    'k-means engine': 'lloyd',
+    'batch size': 1024,
+    'local search time': None,
+    'sparse density': 0.1,
+    'seed': None,
+    'deduplicate': True,
+    'workers': 1,
+    'real': True,
+    'backend': 'win32',
+    'root folder': 'c:/test_dir/',
+    'dry run': False,
+    'apply workers': 1,
+    'folder depth': 1,
+    'subfolders count': 4,
+    'plan file': None,
+    'sid cache size': 4096,
+    'sid cache ttl': None,
+    'scan root': None,
+    'scan workers': 4,
+    'store': None,
+    'max drift': 0.1,
+    'instrumentation sinks': [],
+    'instrumentation file': None,
+    'profile phases': [],
+    'trace memory phases': [],
 }
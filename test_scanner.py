@@ -0,0 +1,18 @@
+import os
+
+from scanner import is_within, tree_names
+
+
+def test_tree_names_are_unique():
+    root = os.path.join(os.sep, 'root')
+    paths = [os.path.join(root, *parts) for parts in
+             (('a', 'b_c'), ('a_b', 'c'), ('a_b_c~1',), ('x', 'y.txt'), ('x_y.txt',))]
+    names = tree_names(root, paths)
+    assert names == ['a_b_c', 'a_b_c~2', 'a_b_c~1', 'x_y.txt', 'x_y~1.txt']
+
+
+def test_is_within():
+    assert is_within('/a/b', '/a')
+    assert is_within('/a', '/a/')
+    assert not is_within('/ab', '/a')
+    assert not is_within('/a', '/a/b')
@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from local_search import LocalSearch
+from scoring import clusters_ace_count, labels_ace_count
+from sparse import SparseMasks
+
+CASES = 100
+
+
+def reference_ace_count(clusters, vectors) -> int:
+    """
+    The loop Test.result used before the scoring module, kept as the reference of the formula
+    """
+    ace_count = 0
+    for cluster in clusters.values():
+        for i in range(vectors.shape[1]):
+            number_aces_for_object = defaultdict(lambda: 0)
+            for vector_index in cluster:
+                number_aces_for_object[vectors[vector_index][i]] += 1
+            number_aces_for_object = sorted(number_aces_for_object.items(), key=lambda v: v[1], reverse=True)
+
+            inherit_index = 0
+            if number_aces_for_object[inherit_index][0] != 0:
+                if number_aces_for_object[inherit_index][0] > 7:
+                    if len([vectors[vector_index][i] < 8 for vector_index in cluster]) != 0:
+                        for tmp in number_aces_for_object:
+                            if tmp[0] < 8:
+                                inherit_index = number_aces_for_object.index(tmp)
+                ace_count += 1
+            for i in number_aces_for_object[0:inherit_index] + number_aces_for_object[inherit_index + 1:]:
+                if i[0] == 0:
+                    ace_count += i[1]
+                else:
+                    ace_count += i[1] * 2
+    return ace_count
+
+
+def random_case(seed: int):
+    """
+    :return: masks and clusters with shuffled members, a few distinct masks per user so the counts tie often
+    """
+    rng = np.random.default_rng(seed)
+    rows_count = int(rng.integers(1, 60))
+    users_count = int(rng.integers(1, 8))
+    alphabet = rng.choice(64, size=int(rng.integers(1, 6)), replace=False)
+    masks = alphabet[rng.integers(len(alphabet), size=(rows_count, users_count))].astype(np.uint8)
+    # most masks are zero in half of the cases
+    if seed % 2:
+        masks[rng.random(masks.shape) < 0.8] = 0
+    labels = rng.integers(int(rng.integers(1, 6)), size=rows_count)
+    clusters = defaultdict(list)
+    for row in rng.permutation(rows_count):
+        clusters[int(labels[row])].append(int(row))
+    return masks, labels, dict(clusters)
+
+
+@pytest.mark.parametrize('seed', range(CASES))
+def test_clusters_ace_count_matches_reference(seed):
+    masks, labels, clusters = random_case(seed)
+    assert clusters_ace_count(clusters, masks) == reference_ace_count(clusters, masks)
+
+
+@pytest.mark.parametrize('seed', range(CASES))
+def test_sparse_clusters_ace_count_matches_reference(seed):
+    masks, labels, clusters = random_case(seed)
+    assert clusters_ace_count(clusters, SparseMasks.from_dense(masks)) == reference_ace_count(clusters, masks)
+
+
+@pytest.mark.parametrize('seed', range(CASES))
+def test_sparse_labels_ace_count_matches_dense(seed):
+    masks, labels, clusters = random_case(seed)
+    clusters_count = int(labels.max()) + 1
+    assert labels_ace_count(SparseMasks.from_dense(masks), labels, clusters_count) == \
+        labels_ace_count(masks, labels, clusters_count)
+
+
+def test_ties_are_broken_by_first_appearance():
+    masks = np.array([[8], [1], [1], [8], [0], [0]], dtype=np.uint8)
+    for clusters in ({0: [0, 1, 2, 3, 4, 5]}, {0: [5, 2, 0, 4, 1, 3]}, {0: [1, 0, 3, 2], 1: [4, 5]}):
+        assert clusters_ace_count(clusters, masks) == reference_ace_count(clusters, masks)
+
+
+@pytest.mark.parametrize('seed', range(CASES))
+def test_local_search_cost_matches_scoring(seed):
+    masks, labels, clusters = random_case(seed)
+    search = LocalSearch(masks, labels, random_state=seed)
+    assert search.ace_count == clusters_ace_count(search.clusters, masks)
+    search.run(time_budget=10)
+    assert search.ace_count == clusters_ace_count(search.clusters, masks)
+    result = search.result()
+    assert clusters_ace_count(result.clusters, masks) == search.ace_count
+    assert len(result.centroids) == int(result.labels.max()) + 1
@@ -0,0 +1,173 @@
+import operator
+import string
+from typing import Sequence
+
+import numpy as np
+
+from acl import AclMatrix
+from kmeans import get_rng
+from sparse import BLOCK_SIZE
+
+# allowed masks of generated ACEs, the denied ones are the same masks shifted by 3
+ALLOWED_MASKS = np.array([1, 2, 3, 5, 7], dtype=np.uint8)
+LETTERS = string.ascii_letters
+NAME_LENGTH = 10
+UINT64 = (1 << 64) - 1
+
+
+def random_rights(rng: np.random.Generator, count: int) -> np.ndarray:
+    """
+    :return: random allowed or denied masks, half of them denied
+    """
+    rights = ALLOWED_MASKS[rng.integers(len(ALLOWED_MASKS), size=count)]
+    return np.where(rng.random(count) < 0.5, rights, rights << 3).astype(np.uint8)
+
+
+def skewed_weights(count: int, skew: float) -> np.ndarray:
+    """
+    :return: Zipf-like weights (rank + 1) ** -skew, all equal for skew 0
+    """
+    return (np.arange(1, count + 1, dtype=np.float64) ** -skew) if count else np.empty(0)
+
+
+def split_sizes(total: int, parts: int, skew: float = 0.0) -> np.ndarray:
+    """
+    :return: sizes of the parts summing to total, proportional to skewed_weights
+    """
+    weights = skewed_weights(parts, skew)
+    sizes = np.floor(total * weights / weights.sum()).astype(np.int64)
+    sizes[:total - sizes.sum()] += 1
+    return sizes
+
+
+def random_rows(rng: np.random.Generator, rows_count: int, users_count: int, user_skew: float = 0.0) -> np.ndarray:
+    """
+    Every row gives random rights to a random number (1..users) of distinct users,
+    users are chosen with probability proportional to skewed_weights (weighted sampling
+    without replacement by the keys u ** (1 / weight))
+    :return: (rows x users) masks
+    """
+    rows = np.zeros((rows_count, users_count), dtype=np.uint8)
+    if users_count == 0:
+        return rows
+    inverse_weights = 1 / skewed_weights(users_count, user_skew)
+    step = max(1, BLOCK_SIZE // users_count)
+    for start in range(0, rows_count, step):
+        count = min(step, rows_count - start)
+        keys = rng.random((count, users_count)) ** inverse_weights
+        ranks = np.argsort(np.argsort(-keys, axis=1), axis=1)
+        lengths = rng.integers(1, users_count + 1, size=count)
+        chosen = ranks < lengths[:, None]
+        rows[start:start + count][chosen] = random_rights(rng, int(chosen.sum()))
+    return rows
+
+
+def invert_rights(masks: np.ndarray, probability: float, rng: np.random.Generator):
+    """
+    Replaces every nonzero mask with probability (percent) by a random mask of the opposite type
+    """
+    users_count = masks.shape[1]
+    step = max(1, BLOCK_SIZE // max(1, users_count))
+    for start in range(0, len(masks), step):
+        block = masks[start:start + step]
+        rows, users = np.nonzero((rng.random(block.shape, dtype=np.float32) * 100 < probability) & (block != 0))
+        rights = ALLOWED_MASKS[rng.integers(len(ALLOWED_MASKS), size=len(rows))]
+        block[rows, users] = np.where(block[rows, users] < 8, rights << 3, rights)
+
+
+def mix(value: int) -> int:
+    """
+    splitmix64 finalizer: a well spread 64 bit hash of a 64 bit value
+    """
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & UINT64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & UINT64
+    return value ^ (value >> 31)
+
+
+class LazyNames(Sequence):
+    """
+    File names prefix + 10 letters derived from (seed, file index), built only when read.
+    Assigned names are kept in a dict.
+    """
+
+    def __init__(self, count: int, seed: int, prefixes: Sequence[str]):
+        """
+        :param prefixes: name prefix of every file (any sequence indexed by file index)
+        """
+        self.count = count
+        self.key = mix(seed & UINT64)
+        self.prefixes = prefixes
+        self.assigned = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        index = operator.index(index)
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        name = self.assigned.get(index)
+        if name is None:
+            value = mix(index ^ self.key)
+            letters = []
+            for _ in range(NAME_LENGTH):
+                value, letter = divmod(value, len(LETTERS))
+                letters.append(LETTERS[letter])
+            name = self.prefixes[index] + ''.join(letters)
+        return name
+
+    def __setitem__(self, index: int, name: str):
+        self.assigned[index] = name
+
+
+class FolderPrefixes(Sequence):
+    """
+    'test_file' for the files of the folders, 'test_file_' for the remaining files
+    """
+
+    def __init__(self, folder_files: int, count: int):
+        self.folder_files = folder_files
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return 'test_file' if index < self.folder_files else 'test_file_'
+
+
+class Workload(object):
+    def __init__(self, acl: AclMatrix, labels: np.ndarray):
+        """
+        :param acl: generated files
+        :param labels: folder of every file, -1 for the files outside the folders
+        """
+        self.acl = acl
+        self.labels = labels
+
+
+def generate_workload(users: Sequence[str], files_count: int, folders_count: int, folder_skew: float = 0.0,
+                      user_skew: float = 0.0, random_state=None) -> Workload:
+    """
+    Files of a folder share the masks of the folder, every folder gives random rights to a random
+    number of users. files_count // folders_count * folders_count files are split between the folders
+    (evenly when folder_skew is 0, otherwise Zipf-like), every remaining file gets its own masks.
+    :param user_skew: Zipf exponent of the user popularity, 0 is uniform
+    :param random_state: seed or np.random.Generator
+    """
+    rng = get_rng(random_state)
+    folders_count = min(folders_count, files_count)
+    folder_files = files_count // folders_count * folders_count if folders_count else 0
+    sizes = split_sizes(folder_files, folders_count, folder_skew)
+    labels = np.concatenate([np.repeat(np.arange(folders_count), sizes),
+                             np.full(files_count - folder_files, -1)]).astype(np.intp)
+
+    rows = random_rows(rng, folders_count + files_count - folder_files, len(users), user_skew)
+    # the remaining files use the rows after the folder rows
+    masks = rows[np.where(labels >= 0, labels, folders_count + np.arange(files_count) - folder_files)]
+    names = LazyNames(files_count, int(rng.integers(2 ** 63)), FolderPrefixes(folder_files, files_count))
+    return Workload(AclMatrix(list(users), masks, names), labels)